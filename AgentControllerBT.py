@@ -7,6 +7,7 @@ import warnings
 import numpy as np
 import random
 from Utilities import Utilities as U
+from States import State
 
 
 # Waypoint Management
@@ -75,10 +76,11 @@ class GenerateRandomWP(py_trees.behaviour.Behaviour):
 
 
 class CheckWP(py_trees.behaviour.Behaviour):
-    def __init__(self, name, currentAgent, sl):
+    def __init__(self, name, currentAgent, sl, swarm):
         super().__init__(name=name)
         self.currentAgent = currentAgent
         self.sl = sl
+        self.swarm = swarm
         self.blackboard = Blackboard
 
     def wp_within_forbidden_area(self):
@@ -102,7 +104,7 @@ class CheckWP(py_trees.behaviour.Behaviour):
         distance = np.nan
         for otherAgent in self.currentAgent.neighbors:
             # Define Distance, ignore Done and Dead agents
-            if otherAgent.state == "Done" or otherAgent.state == "Dead":
+            if otherAgent.state == State.Done or otherAgent.state == State.Dead:
                 distance = np.nan
             else:
                 distance = U.isNear(self.currentAgent.waypoints[0], otherAgent, self.currentAgent.sl.neighborClearance)
@@ -137,6 +139,14 @@ class CheckWP(py_trees.behaviour.Behaviour):
 
     def update(self):
         # print("Checking wp")
+        # The static field can rule out hazards and bounds in one lookup, leaving only the neighbor check
+        field = self.swarm.environment.staticField
+        if field is not None and field.isClear(self.currentAgent.waypoints[0]):
+            self.currentAgent.threateningHazard = None
+            if self.wp_within_neighbor_zone():
+                return Status.FAILURE
+            self.currentAgent.boundError = None
+            return Status.SUCCESS
         # If the next waypoint is inside known hazards, fail the check
         if self.wp_within_forbidden_area():
             # if self.sl.debugEveryStep:
@@ -155,10 +165,11 @@ class CheckWP(py_trees.behaviour.Behaviour):
 
 
 class FixWP(py_trees.behaviour.Behaviour):
-    def __init__(self, name, currentAgent, sl):
+    def __init__(self, name, currentAgent, sl, swarm):
         super().__init__(name=name)
         self.currentAgent = currentAgent
         self.sl = sl
+        self.swarm = swarm
         self.blackboard = Blackboard
 
     def update(self):
@@ -184,6 +195,13 @@ class FixWP(py_trees.behaviour.Behaviour):
             newWP = waypoint + unitVector * self.currentAgent.speed * self.sl.dt
             self.currentAgent.waypoints[0] = newWP
 
+            # arccos is never negative, so the escape turn below is always positive. Skip it with the static field.
+            if self.swarm.environment.staticField is not None:
+                self.currentAgent.heading = self.currentAgent.heading + self.sl.maxRotSpeed * self.sl.dt
+                if self.sl.debugEveryStep:
+                    print("SUCCESS: Fixed WP")
+                return Status.SUCCESS
+
             # also direct the agent away from wall
             unitVecToWall = -unitVector
             angleToHazard = np.arccos(
@@ -204,12 +222,26 @@ class FixWP(py_trees.behaviour.Behaviour):
             waypoint = np.array(self.currentAgent.waypoints[0])
             pos = self.currentAgent.position
             # bump the waypoint directly away from the hazard. the vector goes from the threat to the waypoint
-            vector = waypoint - threat.position
-            dist = np.linalg.norm(vector)
-            unitVector = vector / dist
+            field = self.swarm.environment.staticField
+            repulsion = None
+            if field is not None:
+                repulsion = field.repulsionFrom(waypoint, self.swarm.environment.hazards.index(threat))
+            if repulsion is not None:
+                unitVector = np.array([repulsion[0], repulsion[1], 0.0])
+            else:
+                vector = waypoint - threat.position
+                dist = np.linalg.norm(vector)
+                unitVector = vector / dist
             newWP = waypoint + unitVector * self.currentAgent.speed * self.sl.dt
             self.currentAgent.waypoints[0] = newWP
 
+            # arccos is never negative, so the escape turn below is always positive. Skip it with the static field.
+            if field is not None:
+                self.currentAgent.heading = self.currentAgent.heading + self.sl.maxRotSpeed * self.sl.dt
+                if self.sl.debugEveryStep:
+                    print("SUCCESS: Fixed WP")
+                return Status.SUCCESS
+
             # also direct the agent away from the hazard
             vecToHazard = threat.position - pos
             distToHazard = np.linalg.norm(vecToHazard)
@@ -256,10 +288,11 @@ class FixWP(py_trees.behaviour.Behaviour):
 
 
 class CommitNextWP(py_trees.behaviour.Behaviour):
-    def __init__(self, name, currentAgent, sl):
+    def __init__(self, name, currentAgent, sl, swarm):
         super().__init__(name=name)
         self.currentAgent = currentAgent
         self.sl = sl
+        self.swarm = swarm
         self.blackboard = Blackboard
 
     def update(self):
@@ -271,6 +304,7 @@ class CommitNextWP(py_trees.behaviour.Behaviour):
         self.currentAgent.position = self.currentAgent.waypoints[0]
         self.currentAgent.position = np.array(self.currentAgent.position)
         self.currentAgent.waypoints.pop(0)
+        self.swarm.perception.agentMoved(self.currentAgent)
 
         # if self.sl.debugEveryStep:
         #     print(f"SUCCESS: Commit WP ({self.currentAgent.position[0]:.1f}, {self.currentAgent.position[1]:.1f})")
@@ -285,7 +319,7 @@ class GenerateWPToTarget(py_trees.behaviour.Behaviour):
         self.blackboard = Blackboard
 
     def update(self):
-        if self.currentAgent.state != "Assessing":
+        if self.currentAgent.state != State.Assessing:
             if self.sl.debugEveryStep:
                 print("FAILURE: Not supposed to go to target")
             return Status.FAILURE
@@ -317,9 +351,11 @@ class RollTime(py_trees.behaviour.Behaviour):
         self.type = type
         self.reduceQuality = reduceQuality
         self.blackboard = Blackboard
+        # The only state this roll applies to
+        self.fromState = {"U to E": State.Uncommitted, "R to Q": State.Recruiting, "Q to UR": State.Surveying}[type]
 
     def update(self):
-        State = self.currentAgent.state
+        agentState = self.currentAgent.state
         q = self.currentAgent.qualityOfCommitted
         # if State == "Uncommitted" and self.type == "U to E":
         #     numSeconds = self.sl.t_U_E
@@ -332,31 +368,36 @@ class RollTime(py_trees.behaviour.Behaviour):
         #         print(f"BYPASSED: {self.type} Not Rolled, agent still {self.currentAgent.state}")
         #     return Status.SUCCESS
 
-        if State == "Uncommitted" and self.type == "U to E":
+        if agentState != self.fromState:
+            if self.sl.debugEveryBypass:
+                print(f"BYPASSED: {self.type} Not Rolled, agent still {self.currentAgent.state.name}")
+            return Status.SUCCESS
+        elif agentState == State.Uncommitted:
             numSeconds = self.sl.t_U_E
-        elif State == "Recruiting" and self.type == "R to Q":
+        elif agentState == State.Recruiting:
             numSeconds = self.sl.t_R_Q_a + self.sl.t_R_Q_b * self.currentAgent.qualityOfCommitted
-        elif State == "Surveying" and self.type == "Q to UR":
-            numSeconds = self.sl.t_Q_UR_a + self.sl.t_Q_UR_b * len(self.currentAgent.agentsAtTarget)
         else:
-            if self.sl.debugEveryBypass:
-                print(f"BYPASSED: {self.type} Not Rolled, agent still {self.currentAgent.state}")
-            return Status.SUCCESS
+            numSeconds = self.sl.t_Q_UR_a + self.sl.t_Q_UR_b * len(self.currentAgent.agentsAtTarget)
 
-        p = 1 - np.exp(-self.sl.dt / numSeconds)
         # Edge case where surveyors may flip to recruit before even getting to their target
-        if State == "Surveying" and not self.currentAgent.atTarget:
-            p = 0
-
-        roll = random.random()
-        if roll < p:
+        stalled = agentState == State.Surveying and not self.currentAgent.atTarget
+        if self.sl.presampledTransitions:
+            # p is this step's hazard, spent from a clock sampled once per state
+            p = 0 if stalled else self.sl.dt / numSeconds
+            swarmState = self.currentAgent.swarmState
+            passed = swarmState.spendClock(swarmState.transitionClocks, self.currentAgent.index, p)
+        else:
+            p = 0 if stalled else 1 - np.exp(-self.sl.dt / numSeconds)
+            roll = random.random()
+            passed = roll < p
+        if passed:
             # The roll succeeded, and the agent will change state
-            if State == "Uncommitted" and self.type == "U to E":
-                self.currentAgent.state = "Exploring"
-            elif State == "Recruiting" and self.type == "R to Q":
-                self.currentAgent.state = "Surveying"
-            elif State == "Surveying" and self.type == "Q to UR":
-                self.currentAgent.state = "Recruiting"
+            if agentState == State.Uncommitted:
+                self.currentAgent.state = State.Exploring
+            elif agentState == State.Recruiting:
+                self.currentAgent.state = State.Surveying
+            else:
+                self.currentAgent.state = State.Recruiting
                 self.currentAgent.attemptedToRecruit = []
                 self.currentAgent.qualityOfCommitted = self.currentAgent.qualityOfCommitted / 2
                 if self.sl.debugStateChanges:
@@ -366,14 +407,14 @@ class RollTime(py_trees.behaviour.Behaviour):
 
             if self.sl.debugStateChanges:
                 print(f"SUCCESS: {self.type} Roll Passed (p={p*100:.2f}%, t={numSeconds:.1f}s),"
-                      f" agent waited for {self.currentAgent.timeInState:.1f}s and is now {self.currentAgent.state}")
+                      f" agent waited for {self.currentAgent.timeInState:.1f}s and is now {self.currentAgent.state.name}")
             self.currentAgent.timeInState = 0
             return Status.SUCCESS
         else:
             # The agent will retain its current state.
             self.currentAgent.timeInState += self.sl.dt
             if self.sl.debugEveryStep:
-                print(f"RUNNING: {self.type} Roll Failed (p={p*100:.2f}%), agent still {self.currentAgent.state}")
+                print(f"RUNNING: {self.type} Roll Failed (p={p*100:.2f}%), agent still {self.currentAgent.state.name}")
             return Status.RUNNING
 
 
@@ -388,7 +429,7 @@ class IsRecruited(py_trees.behaviour.Behaviour):
         if (self.currentAgent.recruitedTo is not None) and \
                 (self.currentAgent.recruitedTo is not self.currentAgent.avoidedTarget):
             self.currentAgent.committedTarget = self.currentAgent.recruitedTo
-            self.currentAgent.state = "Assessing"
+            self.currentAgent.state = State.Assessing
             if self.sl.debugEveryStep:
                 print("SUCCESS: Recruited")
             return Status.SUCCESS
@@ -410,7 +451,7 @@ class CheckForTarget(py_trees.behaviour.Behaviour):
         self.blackboard = Blackboard
 
     def update(self):
-        localTargets = U.findItem(self.swarm, self.currentAgent.ID, self.sl, "Targets")
+        localTargets = self.swarm.perception.localTargets(self.currentAgent.ID)
         self.currentAgent.knownTargets = localTargets
 
         if not localTargets:
@@ -424,7 +465,7 @@ class CheckForTarget(py_trees.behaviour.Behaviour):
         elif len(localTargets) == 1:
             self.currentAgent.committedTarget = localTargets[0]
             self.currentAgent.qualityOfCommitted = self.currentAgent.committedTarget.quality
-            self.currentAgent.state = "Assessing"
+            self.currentAgent.state = State.Assessing
             if self.sl.debugEveryStep:
                 print(f"SUCCESS: Agent {self.currentAgent.ID} has found target {self.currentAgent.committedTarget.ID}, "
                       f"quality {self.currentAgent.qualityOfCommitted}")
@@ -432,7 +473,7 @@ class CheckForTarget(py_trees.behaviour.Behaviour):
         else:
             self.currentAgent.committedTarget = localTargets[1]
             self.currentAgent.qualityOfCommitted = self.currentAgent.committedTarget.quality
-            self.currentAgent.state = "Assessing"
+            self.currentAgent.state = State.Assessing
             if self.sl.debugEveryStep:
                 print(f"SUCCESS: Agent {self.currentAgent.ID} has found target {self.currentAgent.committedTarget.ID}, "
                       f"quality {self.currentAgent.qualityOfCommitted}")
@@ -453,10 +494,10 @@ class CheckTargetQuality(py_trees.behaviour.Behaviour):
         mem = self.memory
 
         # First case assumes visiting for the first time, which requires visitor to be Assessing
-        if not mem and self.currentAgent.state == "Assessing":
+        if not mem and self.currentAgent.state == State.Assessing:
             q = self.currentAgent.committedTarget.quality
             if q > threshold:
-                self.currentAgent.state = "Recruiting"
+                self.currentAgent.state = State.Recruiting
                 self.currentAgent.attemptedToRecruit = []
                 if self.sl.debugEveryStep:
                     print("SUCCESS: Real Quality")
@@ -499,13 +540,13 @@ class CheckVerdict(py_trees.behaviour.Behaviour):
     def update(self):
         agentsAtTarget = len(self.currentAgent.agentsAtTarget)
         if agentsAtTarget >= self.sl.agentThreshold:
-            self.currentAgent.state = "Done"
+            self.currentAgent.state = State.Done
             self.currentAgent.committedTarget.numAgents += 1
             if self.sl.debugEveryStep:
                 print("SUCCESS: Verdict is Agent Threshold")
             return Status.SUCCESS
         else:
-            self.currentAgent.state = "Uncommitted"
+            self.currentAgent.state = State.Uncommitted
             self.currentAgent.committedTarget = None
             self.currentAgent.qualityOfCommitted = 0
             self.currentAgent.agentsAtTarget = []
@@ -523,11 +564,12 @@ class DetectObject(py_trees.behaviour.Behaviour):
         self.blackboard = Blackboard
 
     def update(self):
-        localAgents = U.findItem(self.swarm, self.currentAgent.ID, self.sl, "Agents")
+        perception = self.swarm.perception
+        localAgents = perception.localAgents(self.currentAgent.ID)
         self.currentAgent.neighbors = localAgents
-        localTargets = U.findItem(self.swarm, self.currentAgent.ID, self.sl, "Targets")
+        localTargets = perception.localTargets(self.currentAgent.ID)
         self.currentAgent.knownTargets = localTargets
-        localHazards = U.findItem(self.swarm, self.currentAgent.ID, self.sl, "Hazards")
+        localHazards = perception.localHazards(self.currentAgent.ID)
         self.currentAgent.knownHazards = localHazards
         if self.sl.debugEveryStep:
             print("RUNNING: Finding Objects")
@@ -544,7 +586,7 @@ class RecruitOthers(py_trees.behaviour.Behaviour):
 
     def update(self):
         # Get out of here if not in Recruiting mode. Best to set to Success to end it early
-        if self.currentAgent.state != "Recruiting":
+        if self.currentAgent.state != State.Recruiting:
             if self.sl.debugEveryBypass:
                 print("BYPASSED: Not Recruiting")
             return Status.SUCCESS
@@ -557,8 +599,8 @@ class RecruitOthers(py_trees.behaviour.Behaviour):
             if agent.recruitedTo is None:
                 candidates.append(agent)
         # Then add agents that can see currentAgent
-        for agent in self.swarm.agents:
-            if agent.recruitedTo is None and self.currentAgent in agent.neighbors:
+        for agent in self.swarm.perception.seenBy(self.currentAgent.ID):
+            if agent.recruitedTo is None:
                 candidates.append(agent)
 
         # There might be duplicates, but those will be dealt with later.
@@ -597,15 +639,13 @@ class CheckAgentsAtTarget(py_trees.behaviour.Behaviour):
 
         # Then add more entries if the new agents are not already in the list
         # If the agents are in the list, reset their respective times to zero.
+        remembered = {entry[0].ID: entry for entry in self.currentAgent.agentsAtTarget}
         for localAgent in self.currentAgent.neighbors:
             # Locals need to be already at their target, and not already represented in the list.
-            match = False
-            for agent in self.currentAgent.agentsAtTarget:
-                if agent[0] == localAgent:
-                    agent[1] = 0
-                    match = True
-                    break
-            if not match and localAgent.atTarget:
+            entry = remembered.get(localAgent.ID)
+            if entry is not None:
+                entry[1] = 0
+            elif localAgent.atTarget:
                 self.currentAgent.agentsAtTarget.append([localAgent, 0])
 
         # print(self.currentAgent.agentsAtTarget)
@@ -622,7 +662,7 @@ class CheckAgentsAtTarget(py_trees.behaviour.Behaviour):
 
 
 class BT(py_trees.trees.BehaviourTree):
-    def __init__(self, currentAgent, swarm, sl, status_dict):
+    def __init__(self, currentAgent, swarm, sl):
         if True:
             # Define all the leaves
             detect_object = DetectObject("Passive Detection", currentAgent, sl, swarm)
@@ -630,18 +670,18 @@ class BT(py_trees.trees.BehaviourTree):
             grwp_2 = GenerateRandomWP("Generate Random WP 2", currentAgent, sl, "Home")
             grwp_3 = GenerateRandomWP("Generate Random WP 3", currentAgent, sl, "Target")
             gwp_to_target = GenerateWPToTarget("Generate Direct WP to Target", currentAgent, sl)
-            check_wp_1 = CheckWP("Check WP 1", currentAgent, sl)
-            check_wp_2 = CheckWP("Check WP 2", currentAgent, sl)
-            check_wp_3 = CheckWP("Check WP 3", currentAgent, sl)
-            check_wp_4 = CheckWP("Check WP 4", currentAgent, sl)
-            fix_wp_1 = FixWP("Fix WP 1", currentAgent, sl)
-            fix_wp_2 = FixWP("Fix WP 2", currentAgent, sl)
-            fix_wp_3 = FixWP("Fix WP 3", currentAgent, sl)
-            fix_wp_4 = FixWP("Fix WP 4", currentAgent, sl)
-            commit_wp_1 = CommitNextWP("Commit to WP 1", currentAgent, sl)
-            commit_wp_2 = CommitNextWP("Commit to WP 2", currentAgent, sl)
-            commit_wp_3 = CommitNextWP("Commit to WP 3", currentAgent, sl)
-            commit_wp_4 = CommitNextWP("Commit to WP 4", currentAgent, sl)
+            check_wp_1 = CheckWP("Check WP 1", currentAgent, sl, swarm)
+            check_wp_2 = CheckWP("Check WP 2", currentAgent, sl, swarm)
+            check_wp_3 = CheckWP("Check WP 3", currentAgent, sl, swarm)
+            check_wp_4 = CheckWP("Check WP 4", currentAgent, sl, swarm)
+            fix_wp_1 = FixWP("Fix WP 1", currentAgent, sl, swarm)
+            fix_wp_2 = FixWP("Fix WP 2", currentAgent, sl, swarm)
+            fix_wp_3 = FixWP("Fix WP 3", currentAgent, sl, swarm)
+            fix_wp_4 = FixWP("Fix WP 4", currentAgent, sl, swarm)
+            commit_wp_1 = CommitNextWP("Commit to WP 1", currentAgent, sl, swarm)
+            commit_wp_2 = CommitNextWP("Commit to WP 2", currentAgent, sl, swarm)
+            commit_wp_3 = CommitNextWP("Commit to WP 3", currentAgent, sl, swarm)
+            commit_wp_4 = CommitNextWP("Commit to WP 4", currentAgent, sl, swarm)
             roll_UtoE = RollTime("Roll U to E", currentAgent, sl, "U to E", False)
             roll_RtoQ = RollTime("Roll R to Q", currentAgent, sl, "R to Q", False)
             roll_QtoUR = RollTime("Roll Q to UR", currentAgent, sl, "Q to UR", True)
@@ -715,22 +755,5 @@ class BT(py_trees.trees.BehaviourTree):
             root.add_children([detect_object, Retry("[D] Until Success: Roam", roam, 10000)])
 
 
-        self.status_dict = status_dict
         # print(py_trees.display.ascii_tree(root, show_status=True))
         super().__init__(root)
-
-    def tick(self):
-        super().tick()
-        root = self.root
-        self.get_tree_status(root)
-        pass
-
-    def get_tree_status(self, root_node):
-        if not root_node.children:
-            self.status_dict[root_node.name] = str(root_node.status) + ", message " + root_node.feedback_message
-            return
-        else:
-            self.status_dict[root_node.name] = str(root_node.status) + ", message " + root_node.feedback_message
-            for child in root_node.children:
-                self.get_tree_status(child)
-            return
\ No newline at end of file
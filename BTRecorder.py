@@ -0,0 +1,89 @@
+import numpy as np
+import py_trees
+from CompiledBT import CompiledBT, preorder, CODES, STATUSES
+
+
+class BTRecorder:
+    # Records behaviour tree statuses of a few agents while a simulation runs. Every treeInterval steps, each agent in
+    # treeAgents adds one sample: the step, the agent, and one status code per node, with node ids in CompiledBT's
+    # pre-order numbering. Samples go into a ring buffer holding the last treeCapacity of them.
+    # The swarm only creates a recorder when printTree is set, so runs without it pay nothing.
+    def __init__(self, swarm):
+        sl = swarm.simlaw
+        self.swarm = swarm
+        self.interval = max(1, sl.treeInterval)
+        self.agentNums = [i for i in sl.treeAgents if 0 <= i < sl.numAgents]
+        # py_trees nodes of every recorded agent, used to read py_trees statuses and for export
+        self.nodes = {i: preorder(swarm.BTs[i].root) for i in self.agentNums}
+        numNodes = len(self.nodes[self.agentNums[0]]) if self.agentNums else 0
+        self.nodeNames = [node.name for node in self.nodes[self.agentNums[0]]] if self.agentNums else []
+
+        capacity = max(1, sl.treeCapacity)
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.agents = np.zeros(capacity, dtype=np.int32)
+        self.codes = np.zeros((capacity, numNodes), dtype=np.int8)
+        # Total samples ever recorded. The newest is at (numSamples - 1) % capacity.
+        self.numSamples = 0
+
+    def record(self, step):
+        if step % self.interval != 0:
+            return
+        swarm = self.swarm
+        capacity = len(self.steps)
+        for i in self.agentNums:
+            slot = self.numSamples % capacity
+            self.steps[slot] = step
+            self.agents[slot] = i
+            if swarm.batchedBT is not None:
+                self.codes[slot] = swarm.batchedBT.status[:, i]
+            elif isinstance(swarm.BTs[i], CompiledBT):
+                self.codes[slot] = swarm.BTs[i].status
+            else:
+                self.codes[slot] = [CODES[node.status] for node in self.nodes[i]]
+            self.numSamples += 1
+
+    def samples(self, agentNum=None):
+        # Slots of the buffered samples from oldest to newest, optionally only those of one agent
+        capacity = len(self.steps)
+        count = min(self.numSamples, capacity)
+        slots = (self.numSamples - count + np.arange(count)) % capacity
+        if agentNum is not None:
+            slots = slots[self.agents[slots] == agentNum]
+        return slots
+
+    def history(self, agentNum, nodeName):
+        # (steps, statuses) of one node of one agent over the buffered samples
+        slots = self.samples(agentNum)
+        column = self.nodeNames.index(nodeName)
+        return self.steps[slots], [STATUSES[code] for code in self.codes[slots, column]]
+
+    def render(self, slot, display):
+        # Shows a sample with a py_trees display function, e.g. py_trees.display.ascii_tree or xhtml_tree.
+        # Statuses are lent to the agent's py_trees nodes and put back afterwards.
+        nodes = self.nodes[int(self.agents[slot])]
+        saved = [node.status for node in nodes]
+        for node, code in zip(nodes, self.codes[slot]):
+            node.status = STATUSES[code]
+        try:
+            return display(nodes[0], show_status=True)
+        finally:
+            for node, status in zip(nodes, saved):
+                node.status = status
+
+    def ascii(self, slot=None):
+        if slot is None:
+            slot = self.samples()[-1]
+        return self.render(slot, py_trees.display.ascii_tree)
+
+    def writeHtml(self, filename='BT.html', slot=None):
+        # Writes one sample, the newest by default, in the format printTree used to write every step
+        if self.numSamples == 0:
+            return
+        if slot is None:
+            slot = self.samples()[-1]
+        f = open(filename, 'w')
+        f.write('<html><head><title>Behavior Tree</title><body>')
+        f.write(f"<p>Agent {self.agents[slot]}, step {self.steps[slot]}</p>")
+        f.write(self.render(slot, py_trees.display.xhtml_tree))
+        f.write("</body></html>")
+        f.close()
@@ -0,0 +1,569 @@
+import random
+import numpy as np
+from AgentControllerBT import GenerateRandomWP, CheckWP, CommitNextWP, GenerateWPToTarget, RollTime, \
+    CheckAgentsAtTarget, RecruitOthers
+from CompiledBT import CompiledBT, preorder, CODES, STATUSES, LEAF, SEQUENCE, SELECTOR, PARALLEL, RETRY, REPEAT, \
+    INVALID, RUNNING, SUCCESS, FAILURE
+from States import State
+
+
+class BatchedBT:
+    # Ticks the behaviour trees of the whole swarm together. Every agent has the same tree, so the compiled node
+    # table of agent 0 describes all of them, and per-node statuses are stored as (node, agent) arrays.
+    # Composites and decorators apply the py_trees rules to whole sets of agents at once, and each leaf runs once per
+    # step for every agent that reaches it. Leaves listed in BATCHED_LEAVES do that as array operations, the rest call
+    # update() for each agent in the group.
+    # Agents advance leaf by leaf instead of one whole tree at a time, so an agent sees its neighbors' moves from
+    # the same step in a different order than the sequential engines do. Results match statistically, not bit for bit.
+    # Lockstep runs pass one seed per replicate. Replicate r then owns the agents replicateSize * r onwards, and its
+    # agents draw only from that replicate's own random streams.
+    def __init__(self, swarm, bts, seeds=None):
+        self.swarm = swarm
+        self.sl = swarm.simlaw
+        table = CompiledBT(bts[0])
+        self.nodes = table.nodes
+        self.kinds = table.kinds
+        self.children = table.children
+        self.params = table.params
+        self.synchronise = table.synchronise
+        self.leafInitialise = table.leafInitialise
+        self.leafTerminate = table.leafTerminate
+
+        numNodes = len(self.nodes)
+        numAgents = len(bts)
+        # agentNodes[i][n] is agent i's py_trees node n, leafObjects[n][i] is agent i's behaviour at leaf n
+        self.agentNodes = [preorder(bt.root) for bt in bts]
+        self.leafObjects = [None] * numNodes
+        self.batchUpdates = [None] * numNodes
+        for n in range(numNodes):
+            if self.kinds[n] == LEAF:
+                self.leafObjects[n] = [nodes[n] for nodes in self.agentNodes]
+                self.batchUpdates[n] = BATCHED_LEAVES.get(type(self.nodes[n]))
+
+        self.status = np.zeros((numNodes, numAgents), dtype=np.int8)
+        self.current = -np.ones((numNodes, numAgents), dtype=np.int16)
+        self.count = np.zeros((numNodes, numAgents), dtype=np.int64)
+        # Batched leaves draw from a numpy generator per replicate. Leaves in RANDOM_LEAVES that run per agent use the
+        # random module, whose state is swapped per replicate when randomStates is set.
+        if seeds is None:
+            seeds = [self.sl.rngSeed]
+        self.rngs = [np.random.default_rng(seed) for seed in seeds]
+        self.bounds = np.arange(len(seeds) + 1) * (numAgents // len(seeds))
+        self.randomStates = None
+
+    def tick(self, indices):
+        self.tickNode(0, np.asarray(indices, dtype=np.int64))
+
+    def tickNode(self, n, idx):
+        if len(idx) == 0:
+            return
+        kind = self.kinds[n]
+        status = self.status
+        children = self.children[n]
+
+        if kind == LEAF:
+            leaves = self.leafObjects[n]
+            if self.leafInitialise[n]:
+                for i in idx[status[n, idx] != RUNNING]:
+                    leaves[i].initialise()
+            batch = self.batchUpdates[n]
+            if batch is not None:
+                newStatus = batch(self, self.nodes[n], idx)
+            else:
+                newStatus = self.updateEach(n, idx)
+            notRunning = newStatus != RUNNING
+            self.stopNode(n, idx[notRunning], newStatus[notRunning])
+            status[n, idx] = newStatus
+
+        elif kind == SEQUENCE:
+            memory = self.params[n]
+            running = status[n, idx] == RUNNING
+            fresh = idx[~running]
+            self.current[n, fresh] = 0
+            for child in children:
+                self.stopNode(child, fresh[status[child, fresh] != INVALID], INVALID)
+            start = np.zeros(len(idx), dtype=np.int64)
+            if memory:
+                current = self.current[n, idx]
+                resume = running & (current >= 0)
+                start[resume] = current[resume]
+                self.current[n, idx[running & ~resume]] = 0
+            else:
+                self.current[n, idx[running]] = 0
+
+            active = idx
+            for k in range(len(children)):
+                child = children[k]
+                ticking = np.flatnonzero(start <= k)
+                tickers = active[ticking]
+                if len(tickers) == 0:
+                    continue
+                self.tickNode(child, tickers)
+                childStatus = status[child, tickers]
+                unfinished = childStatus != SUCCESS
+                stopped = tickers[unfinished]
+                stoppedStatus = childStatus[unfinished]
+                if not memory:
+                    for later in children[k + 1:]:
+                        self.stopNode(later, stopped[status[later, stopped] != INVALID], INVALID)
+                failed = stoppedStatus != RUNNING
+                self.stopNode(n, stopped[failed], stoppedStatus[failed])
+                status[n, stopped[~failed]] = RUNNING
+                if k + 1 < len(children):
+                    self.current[n, tickers[~unfinished]] = k + 1
+                keep = np.ones(len(active), dtype=bool)
+                keep[ticking[unfinished]] = False
+                active = active[keep]
+                start = start[keep]
+            self.stopNode(n, active, SUCCESS)
+
+        elif kind == SELECTOR:
+            self.current[n, idx[status[n, idx] != RUNNING]] = 0
+            if self.params[n]:
+                start = self.current[n, idx].astype(np.int64)
+                for k in range(len(children)):
+                    earlier = idx[start > k]
+                    self.stopNode(children[k], earlier[status[children[k], earlier] != INVALID], INVALID)
+            else:
+                start = np.zeros(len(idx), dtype=np.int64)
+            previous = self.current[n, idx].copy()
+
+            active = idx
+            for k in range(len(children)):
+                child = children[k]
+                ticking = np.flatnonzero(start <= k)
+                tickers = active[ticking]
+                if len(tickers) == 0:
+                    continue
+                self.tickNode(child, tickers)
+                childStatus = status[child, tickers]
+                chosen = (childStatus == RUNNING) | (childStatus == SUCCESS)
+                picked = tickers[chosen]
+                self.current[n, picked] = k
+                switched = picked[previous[ticking][chosen] != k]
+                for later in children[k + 1:]:
+                    self.stopNode(later, switched[status[later, switched] != INVALID], INVALID)
+                succeeded = childStatus[chosen] == SUCCESS
+                self.stopNode(n, picked[succeeded], SUCCESS)
+                status[n, picked[~succeeded]] = RUNNING
+                keep = np.ones(len(active), dtype=bool)
+                keep[ticking[chosen]] = False
+                active = active[keep]
+                start = start[keep]
+                previous = previous[keep]
+            self.stopNode(n, active, FAILURE)
+            self.current[n, active] = len(children) - 1
+
+        elif kind == PARALLEL:
+            fresh = idx[status[n, idx] != RUNNING]
+            for child in children:
+                self.stopNode(child, fresh[status[child, fresh] != INVALID], INVALID)
+            self.current[n, fresh] = -1
+            for child in children:
+                if self.synchronise[n]:
+                    self.tickNode(child, idx[status[child, idx] != SUCCESS])
+                else:
+                    self.tickNode(child, idx)
+            childStatus = status[np.array(children)][:, idx]
+            numChildren = len(children)
+            newStatus = np.full(len(idx), RUNNING, dtype=np.int8)
+            current = np.full(len(idx), numChildren - 1, dtype=np.int16)
+            failures = childStatus == FAILURE
+            failed = failures.any(axis=0)
+            newStatus[failed] = FAILURE
+            current[failed] = np.argmax(failures, axis=0)[failed]
+            successes = childStatus == SUCCESS
+            if self.params[n]:
+                # Success on one
+                succeeded = ~failed & successes.any(axis=0)
+                current[succeeded] = (numChildren - 1 - np.argmax(successes[::-1], axis=0))[succeeded]
+            else:
+                succeeded = ~failed & successes.all(axis=0)
+            newStatus[succeeded] = SUCCESS
+            self.current[n, idx] = current
+            notRunning = newStatus != RUNNING
+            self.stopNode(n, idx[notRunning], newStatus[notRunning])
+            status[n, idx] = newStatus
+
+        else:
+            # Decorators
+            child = children[0]
+            self.count[n, idx[status[n, idx] != RUNNING]] = 0
+            self.tickNode(child, idx)
+            childStatus = status[child, idx]
+            if kind == RETRY:
+                failed = childStatus == FAILURE
+                self.count[n, idx[failed]] += 1
+                newStatus = np.where(childStatus == RUNNING, RUNNING, SUCCESS).astype(np.int8)
+                newStatus[failed] = np.where(self.count[n, idx[failed]] < self.params[n], RUNNING, FAILURE)
+            elif kind == REPEAT:
+                succeeded = childStatus == SUCCESS
+                self.count[n, idx[succeeded]] += 1
+                newStatus = np.where(childStatus == FAILURE, FAILURE, RUNNING).astype(np.int8)
+                newStatus[succeeded & (self.count[n, idx] == self.params[n])] = SUCCESS
+            else:
+                newStatus = childStatus.copy()
+                newStatus[childStatus == SUCCESS] = FAILURE
+                newStatus[childStatus == FAILURE] = SUCCESS
+            notRunning = newStatus != RUNNING
+            self.stopNode(n, idx[notRunning], newStatus[notRunning])
+            status[n, idx] = newStatus
+
+    def stopNode(self, n, idx, newStatus):
+        if len(idx) == 0:
+            return
+        kind = self.kinds[n]
+        status = self.status
+        children = self.children[n]
+        newStatus = np.broadcast_to(np.asarray(newStatus, dtype=np.int8), idx.shape)
+        if kind == LEAF:
+            if self.leafTerminate[n]:
+                for i, code in zip(idx, newStatus):
+                    self.leafObjects[n][i].terminate(STATUSES[code])
+        elif kind == SEQUENCE or kind == SELECTOR or kind == PARALLEL:
+            if kind == PARALLEL:
+                for child in children:
+                    self.stopNode(child, idx[status[child, idx] == RUNNING], INVALID)
+            invalid = idx[newStatus == INVALID]
+            if len(invalid):
+                self.current[n, invalid] = -1
+                for child in children:
+                    self.stopNode(child, invalid[status[child, invalid] != INVALID], INVALID)
+        else:
+            child = children[0]
+            self.stopNode(child, idx[newStatus == INVALID], INVALID)
+            self.stopNode(child, idx[status[child, idx] == RUNNING], INVALID)
+        status[n, idx] = newStatus
+
+    def updateEach(self, n, idx):
+        # Runs a leaf without a batched version through each agent's own update()
+        leaves = self.leafObjects[n]
+        if self.randomStates is None or type(self.nodes[n]) not in RANDOM_LEAVES:
+            return np.array([CODES.get(leaves[i].update(), INVALID) for i in idx], dtype=np.int8)
+        codes = []
+        cuts = np.searchsorted(idx, self.bounds)
+        for r in range(len(self.rngs)):
+            if cuts[r] == cuts[r + 1]:
+                continue
+            random.setstate(self.randomStates[r])
+            codes.extend(CODES.get(leaves[i].update(), INVALID) for i in idx[cuts[r]:cuts[r + 1]].tolist())
+            self.randomStates[r] = random.getstate()
+        return np.array(codes, dtype=np.int8)
+
+    def draw(self, idx, sample):
+        # One sample per agent in idx, which must be ascending, each from its replicate's generator
+        if len(self.rngs) == 1:
+            return sample(self.rngs[0], len(idx))
+        cuts = np.searchsorted(idx, self.bounds)
+        return np.concatenate([sample(self.rngs[r], cuts[r + 1] - cuts[r]) for r in range(len(self.rngs))])
+
+    def random(self, idx):
+        return self.draw(idx, lambda rng, size: rng.random(size))
+
+    def uniform(self, low, high, idx):
+        return self.draw(idx, lambda rng, size: rng.uniform(low, high, size))
+
+    def exponential(self, idx):
+        return self.draw(idx, lambda rng, size: rng.exponential(size=size))
+
+    def step(self):
+        # One step of the swarm: tick every live agent's tree, then roll for deaths as Swarm.stepSimulation does
+        sl = self.sl
+        state = self.swarm.swarmState
+        alive = np.flatnonzero(state.states < State.Done)
+        self.tick(alive)
+        if sl.lifespan > 0:
+            moving = alive[state.states[alive] != State.Uncommitted]
+            if sl.presampledTransitions:
+                dying = moving[state.spendClocks(state.deathClocks, moving, sl.dt / sl.lifespan, self.exponential)]
+            else:
+                dying = moving[self.random(moving) < 1 - np.exp(-sl.dt / sl.lifespan)]
+            state.setStates(dying, State.Dead)
+            state.committedTargets[dying] = -1
+            state.atTargets[dying] = False
+
+    def syncStatus(self, agentIndex):
+        # Copy one agent's statuses onto its py_trees nodes, e.g. so py_trees.display can render them.
+        for n, node in enumerate(self.agentNodes[agentIndex]):
+            node.status = STATUSES[self.status[n, agentIndex]]
+
+
+def norm(vectors):
+    # Row lengths. Uses the same dot product as np.linalg.norm on a single vector, so rounding matches the
+    # per-agent leaves exactly.
+    return np.sqrt((vectors[:, None, :] @ vectors[:, :, None])[:, 0, 0])
+
+
+def neighborEdges(engine, idx):
+    # Neighbor lists of the agents in idx as pairs (row, neighbor). DetectObject runs first on every tick, so with
+    # batched perception each list is that agent's row of the visibility graph and can be read from there.
+    swarm = engine.swarm
+    if swarm.perception.mode == "Batched":
+        return swarm.visibility.edgesFrom(idx)
+    rows = []
+    others = []
+    for row, i in enumerate(idx.tolist()):
+        # Agent IDs count from the start of the agent's own replicate
+        base = i - swarm.agents[i].ID
+        for other in swarm.agents[i].neighbors:
+            rows.append(row)
+            others.append(base + other.ID)
+    return np.array(rows, dtype=np.int64), np.array(others, dtype=np.int64)
+
+
+# Batched leaf updates. Each takes the engine, agent 0's behaviour at the node (for its parameters) and the indices
+# of the agents ticking it, and returns their status codes. They follow the matching update() in AgentControllerBT.
+
+def generateRandomWP(engine, leaf, idx):
+    swarm = engine.swarm
+    sl = engine.sl
+    state = swarm.swarmState
+    angleChange = engine.uniform(-1, 1, idx) * sl.maxRotSpeed
+    positions = state.positions[idx].astype(float)
+    headings = state.headings[idx].astype(float)
+    goal = None
+    if leaf.targetCode == "None" or leaf.targetCode == "Home":
+        state.atTargets[idx] = False
+        if leaf.targetCode == "Home":
+            goal = np.broadcast_to(np.array(swarm.environment.home.position[:2], dtype=float), (len(idx), 2))
+            normalDistance = sl.homeClearance
+    else:
+        targets = swarm.environment.targets
+        goal = np.array([targets[j].position[:2] for j in state.committedTargets[idx]], dtype=float)
+        radii = np.array([targets[j].radius for j in state.committedTargets[idx]], dtype=float)
+        normalDistance = sl.targetClearance
+        dist = norm(goal - positions[:, :2])
+        arrived = (dist < sl.targetClearance) | (dist < radii)
+        state.atTargets[idx[arrived]] = True
+
+    if goal is not None:
+        headings = headings % (2 * np.pi)
+        vec = goal - positions[:, :2]
+        dist = norm(vec)
+        angleToTarget = np.arctan2(-vec[:, 1], vec[:, 0]) - headings
+        angleToTarget = (np.pi + angleToTarget) % (2 * np.pi) - np.pi
+        weight = (dist / normalDistance) ** 2
+        angleChange = (angleChange + weight * angleToTarget) / (1 + weight)
+
+    headings = (headings + angleChange * sl.dt) % (2 * np.pi)
+    state.headings[idx] = headings
+    speeds = state.speeds[idx].astype(float)
+    x = positions[:, 0] + np.cos(headings) * speeds * sl.dt
+    y = positions[:, 1] - np.sin(headings) * speeds * sl.dt
+    agents = swarm.agents
+    for i, newX, newY in zip(idx.tolist(), x.tolist(), y.tolist()):
+        agents[i].waypoints.append([newX, newY, 0])
+    return np.full(len(idx), SUCCESS, dtype=np.int8)
+
+
+def generateWPToTarget(engine, leaf, idx):
+    swarm = engine.swarm
+    sl = engine.sl
+    state = swarm.swarmState
+    newStatus = np.full(len(idx), FAILURE, dtype=np.int8)
+    assessing = idx[state.states[idx] == State.Assessing]
+    if len(assessing) == 0:
+        return newStatus
+    targets = swarm.environment.targets
+    goal = np.array([targets[j].position for j in state.committedTargets[assessing]], dtype=float)
+    radii = np.array([targets[j].radius for j in state.committedTargets[assessing]], dtype=float)
+    positions = state.positions[assessing].astype(float)
+    vec = goal - positions
+    dist = norm(vec)
+    arrived = (dist < sl.targetClearance) | (dist < radii)
+    state.atTargets[assessing[arrived]] = True
+    moving = ~arrived
+    movers = assessing[moving]
+    vec = vec[moving]
+    dist = dist[moving]
+    state.headings[movers] = np.arctan2(-vec[:, 1], vec[:, 0])
+    newPositions = positions[moving] + vec / dist[:, None] * state.speeds[movers, None] * sl.dt
+    agents = swarm.agents
+    for i, newPos in zip(movers.tolist(), newPositions):
+        agents[i].waypoints.append(newPos)
+    newStatus[np.isin(idx, movers)] = SUCCESS
+    return newStatus
+
+
+def checkWP(engine, leaf, idx):
+    swarm = engine.swarm
+    sl = engine.sl
+    agents = swarm.agents
+    env = swarm.environment
+    waypoints = np.array([agents[i].waypoints[0][:2] for i in idx.tolist()], dtype=float).reshape(-1, 2)
+
+    # Known hazards, tested in the order the agent knows them
+    hazardThreats = [None] * len(idx)
+    if env.numHazards > 0:
+        centers = np.array([h.position[:2] for h in env.hazards], dtype=float)
+        reach = np.array([h.radius for h in env.hazards], dtype=float) + sl.hazardClearance
+        dist = np.hypot(waypoints[:, None, 0] - centers[:, 0], waypoints[:, None, 1] - centers[:, 1])
+        inside = (dist <= reach) & (dist > 0)
+        for row, i in enumerate(idx.tolist()):
+            for hazard in agents[i].knownHazards:
+                if inside[row, hazard.ID]:
+                    hazardThreats[row] = hazard
+                    break
+
+    # Neighbor zone, as pairs of (row, neighbor). Like wp_within_neighbor_zone, the verdict comes from the last
+    # neighbor, and the threat is the closest one strictly inside neighborClearance.
+    rows, others = neighborEdges(engine, idx)
+    neighborThreat = np.zeros(len(idx), dtype=bool)
+    threateningNeighbor = np.full(len(idx), -1, dtype=np.int64)
+    if len(rows):
+        state = swarm.swarmState
+        diff = state.positions[others, :2].astype(float) - waypoints[rows]
+        dist = np.hypot(diff[:, 0], diff[:, 1])
+        near = (dist <= sl.neighborClearance) & (dist > 0) & (state.states[others] < State.Done)
+        last = np.r_[rows[1:] != rows[:-1], True]
+        neighborThreat[rows[last]] = near[last]
+        closer = near & (dist < sl.neighborClearance)
+        if closer.any():
+            # First minimum per row: sort by row, then distance, keeping list order for ties
+            order = np.lexsort((np.arange(len(rows))[closer], dist[closer], rows[closer]))
+            closeRows = rows[closer][order]
+            first = np.r_[True, closeRows[1:] != closeRows[:-1]]
+            threateningNeighbor[closeRows[first]] = others[closer][order][first]
+
+    x = waypoints[:, 0]
+    y = waypoints[:, 1]
+    bounds = np.select([x <= sl.hazardClearance, x >= sl.mapWidth - sl.hazardClearance,
+                        y <= sl.hazardClearance, y >= sl.mapHeight - sl.hazardClearance], [1, 2, 3, 4], 0)
+    boundNames = (None, "Left", "Right", "Top", "Bottom")
+
+    newStatus = np.full(len(idx), SUCCESS, dtype=np.int8)
+    for row, i in enumerate(idx.tolist()):
+        agent = agents[i]
+        if hazardThreats[row] is not None:
+            agent.threateningHazard = hazardThreats[row]
+            newStatus[row] = FAILURE
+            continue
+        agent.threateningHazard = None
+        if threateningNeighbor[row] >= 0:
+            agent.threateningNeighbor = agents[threateningNeighbor[row]]
+        if neighborThreat[row]:
+            newStatus[row] = FAILURE
+            continue
+        agent.boundError = boundNames[bounds[row]]
+        if bounds[row]:
+            newStatus[row] = FAILURE
+    return newStatus
+
+
+def commitNextWP(engine, leaf, idx):
+    swarm = engine.swarm
+    agents = swarm.agents
+    newStatus = np.full(len(idx), FAILURE, dtype=np.int8)
+    movers = [row for row, i in enumerate(idx.tolist()) if agents[i].waypoints]
+    if not movers:
+        return newStatus
+    movers = np.array(movers)
+    swarm.swarmState.positions[idx[movers]] = [agents[i].waypoints.pop(0) for i in idx[movers].tolist()]
+    if swarm.perception.agentHash is not None:
+        for i in idx[movers].tolist():
+            swarm.perception.agentMoved(agents[i])
+    newStatus[movers] = SUCCESS
+    return newStatus
+
+
+def rollTime(engine, leaf, idx):
+    swarm = engine.swarm
+    sl = engine.sl
+    state = swarm.swarmState
+    newStatus = np.full(len(idx), SUCCESS, dtype=np.int8)
+    rolling = idx[state.states[idx] == leaf.fromState]
+    if len(rolling) == 0:
+        return newStatus
+    if leaf.fromState == State.Uncommitted:
+        numSeconds = np.full(len(rolling), float(sl.t_U_E))
+    elif leaf.fromState == State.Recruiting:
+        numSeconds = sl.t_R_Q_a + sl.t_R_Q_b * state.qualities[rolling].astype(float)
+    else:
+        numSeconds = sl.t_Q_UR_a + sl.t_Q_UR_b * np.array([len(swarm.agents[i].agentsAtTarget)
+                                                           for i in rolling.tolist()], dtype=float)
+    if sl.presampledTransitions:
+        p = sl.dt / numSeconds
+    else:
+        p = 1 - np.exp(-sl.dt / numSeconds)
+    # Edge case where surveyors may flip to recruit before even getting to their target
+    if leaf.fromState == State.Surveying:
+        p[~state.atTargets[rolling]] = 0
+
+    if sl.presampledTransitions:
+        passed = state.spendClocks(state.transitionClocks, rolling, p, engine.exponential)
+    else:
+        passed = engine.random(rolling) < p
+    changed = rolling[passed]
+    if leaf.fromState == State.Uncommitted:
+        state.setStates(changed, State.Exploring)
+    elif leaf.fromState == State.Recruiting:
+        state.setStates(changed, State.Surveying)
+    else:
+        state.setStates(changed, State.Recruiting)
+        state.qualities[changed] /= 2
+        for i in changed.tolist():
+            swarm.agents[i].attemptedToRecruit = []
+    state.timeInStates[changed] = 0
+    state.timeInStates[rolling[~passed]] += sl.dt
+    newStatus[np.isin(idx, rolling[~passed])] = RUNNING
+    return newStatus
+
+
+def checkAgentsAtTarget(engine, leaf, idx):
+    swarm = engine.swarm
+    sl = engine.sl
+    agents = swarm.agents
+    state = swarm.swarmState
+    numAgents = len(agents)
+    # Flatten every memory entry of the group into (row, other agent, time since seen)
+    rows = []
+    others = []
+    times = []
+    for row, i in enumerate(idx.tolist()):
+        base = i - agents[i].ID
+        for entry in agents[i].agentsAtTarget:
+            rows.append(row)
+            others.append(base + entry[0].ID)
+            times.append(entry[1])
+    rows = np.array(rows, dtype=np.int64)
+    others = np.array(others, dtype=np.int64)
+    times = np.array(times, dtype=float)
+    # Forget old entries, then age the rest
+    fresh = times < sl.memoryLimit
+    rows = rows[fresh]
+    others = others[fresh]
+    times = times[fresh] + sl.dt
+
+    seenRows, seenOthers = neighborEdges(engine, idx)
+    # Neighbors already remembered are reset, new ones are added if they are at their target
+    remembered = np.isin(rows * numAgents + others, seenRows * numAgents + seenOthers)
+    times[remembered] = 0
+    known = np.isin(seenRows * numAgents + seenOthers, rows * numAgents + others)
+    added = ~known & state.atTargets[seenOthers]
+
+    rows = np.concatenate((rows, seenRows[added]))
+    others = np.concatenate((others, seenOthers[added]))
+    times = np.concatenate((times, np.zeros(added.sum())))
+    order = np.argsort(rows, kind='stable')
+    bounds = np.searchsorted(rows[order], np.arange(len(idx) + 1))
+    othersList = others[order].tolist()
+    timesList = times[order].tolist()
+    counts = np.diff(bounds)
+    for row, i in enumerate(idx.tolist()):
+        agents[i].agentsAtTarget = [[agents[othersList[k]], timesList[k]] for k in range(bounds[row], bounds[row + 1])]
+
+    done = (counts >= sl.agentThreshold) & state.atTargets[idx]
+    return np.where(done, SUCCESS, RUNNING).astype(np.int8)
+
+
+BATCHED_LEAVES = {
+    GenerateRandomWP: generateRandomWP,
+    GenerateWPToTarget: generateWPToTarget,
+    CheckWP: checkWP,
+    CommitNextWP: commitNextWP,
+    RollTime: rollTime,
+    CheckAgentsAtTarget: checkAgentsAtTarget,
+}
+
+# Leaves whose update() draws from the random module
+RANDOM_LEAVES = {GenerateRandomWP, RollTime, RecruitOthers}
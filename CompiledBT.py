@@ -0,0 +1,278 @@
+import py_trees
+from py_trees.common import Status, ParallelPolicy
+from py_trees.decorators import Inverter, Retry, Repeat
+
+# Node kinds in the compiled table
+LEAF = 0
+SEQUENCE = 1
+SELECTOR = 2
+PARALLEL = 3
+RETRY = 4
+REPEAT = 5
+INVERTER = 6
+
+# Status codes. STATUSES[code] gives the py_trees status back.
+INVALID = 0
+RUNNING = 1
+SUCCESS = 2
+FAILURE = 3
+STATUSES = (Status.INVALID, Status.RUNNING, Status.SUCCESS, Status.FAILURE)
+CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+def preorder(root):
+    # Nodes of a py_trees tree in the order CompiledBT numbers them
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node.children))
+    return nodes
+
+
+class CompiledBT:
+    # Flat, table-driven executor for a py_trees tree built by AgentControllerBT.BT.
+    # The tree is flattened once into arrays indexed by node number (pre-order, root is 0). Ticking walks those
+    # arrays with plain function calls and integer statuses instead of py_trees' generators, following the same
+    # tick and stop rules as py_trees for every composite and decorator used in BT. Leaves still run their own
+    # update() methods, so agents behave identically.
+    def __init__(self, bt):
+        self.bt = bt
+        self.root = bt.root
+        self.nodes = []
+        self.kinds = []
+        self.children = []
+        self.params = []
+        self.synchronise = []
+        self.leaves = []
+        self.leafInitialise = []
+        self.leafTerminate = []
+        self.compile(bt.root)
+
+        numNodes = len(self.nodes)
+        self.status = [INVALID] * numNodes
+        # Index of the current child for composites, -1 for none
+        self.current = [-1] * numNodes
+        # Failures counted by Retry, successes counted by Repeat
+        self.count = [0] * numNodes
+
+    def compile(self, node):
+        n = len(self.nodes)
+        self.nodes.append(node)
+        self.kinds.append(LEAF)
+        self.children.append(())
+        self.params.append(None)
+        self.synchronise.append(False)
+        self.leaves.append(None)
+        self.leafInitialise.append(False)
+        self.leafTerminate.append(False)
+
+        if isinstance(node, py_trees.composites.Sequence):
+            self.kinds[n] = SEQUENCE
+            self.params[n] = node.memory
+        elif isinstance(node, py_trees.composites.Selector):
+            self.kinds[n] = SELECTOR
+            self.params[n] = node.memory
+        elif isinstance(node, py_trees.composites.Parallel):
+            if not isinstance(node.policy, (ParallelPolicy.SuccessOnOne, ParallelPolicy.SuccessOnAll)):
+                raise ValueError(f"Cannot compile parallel policy {type(node.policy).__name__} of '{node.name}'")
+            self.kinds[n] = PARALLEL
+            self.params[n] = isinstance(node.policy, ParallelPolicy.SuccessOnOne)
+            self.synchronise[n] = node.policy.synchronise
+        elif isinstance(node, Retry):
+            self.kinds[n] = RETRY
+            self.params[n] = node.num_failures
+        elif isinstance(node, Repeat):
+            self.kinds[n] = REPEAT
+            self.params[n] = node.num_success
+        elif isinstance(node, Inverter):
+            self.kinds[n] = INVERTER
+        elif node.children:
+            raise ValueError(f"Cannot compile {type(node).__name__} node '{node.name}'")
+        else:
+            self.leaves[n] = node
+            # Only call hooks the leaf actually overrides
+            self.leafInitialise[n] = type(node).initialise is not py_trees.behaviour.Behaviour.initialise
+            self.leafTerminate[n] = type(node).terminate is not py_trees.behaviour.Behaviour.terminate
+
+        self.children[n] = tuple(self.compile(child) for child in node.children)
+        return n
+
+    def tick(self):
+        self.tickNode(0)
+
+    def tickNode(self, n):
+        kind = self.kinds[n]
+        status = self.status
+        children = self.children[n]
+
+        if kind == LEAF:
+            leaf = self.leaves[n]
+            if self.leafInitialise[n] and status[n] != RUNNING:
+                leaf.initialise()
+            newStatus = CODES.get(leaf.update(), INVALID)
+            if newStatus != RUNNING:
+                self.stopNode(n, newStatus)
+            status[n] = newStatus
+
+        elif kind == SEQUENCE:
+            memory = self.params[n]
+            index = 0
+            if status[n] != RUNNING:
+                self.current[n] = 0
+                for child in children:
+                    if status[child] != INVALID:
+                        self.stopNode(child, INVALID)
+            elif memory and self.current[n] >= 0:
+                index = self.current[n]
+            else:
+                self.current[n] = 0
+            position = index
+            for k in range(index, len(children)):
+                child = children[k]
+                self.tickNode(child)
+                if status[child] != SUCCESS:
+                    if not memory:
+                        for later in children[position + 1:]:
+                            if status[later] != INVALID:
+                                self.stopNode(later, INVALID)
+                    if status[child] != RUNNING:
+                        self.stopNode(n, status[child])
+                    else:
+                        status[n] = RUNNING
+                    return
+                if position + 1 < len(children):
+                    self.current[n] = position + 1
+                    position += 1
+            self.stopNode(n, SUCCESS)
+
+        elif kind == SELECTOR:
+            if status[n] != RUNNING:
+                self.current[n] = 0
+            if self.params[n]:
+                index = self.current[n]
+                for child in children[:index]:
+                    if status[child] != INVALID:
+                        self.stopNode(child, INVALID)
+            else:
+                index = 0
+            previous = self.current[n]
+            for k in range(index, len(children)):
+                child = children[k]
+                self.tickNode(child)
+                childStatus = status[child]
+                if childStatus == RUNNING or childStatus == SUCCESS:
+                    self.current[n] = k
+                    if previous != k:
+                        for later in children[k + 1:]:
+                            if status[later] != INVALID:
+                                self.stopNode(later, INVALID)
+                    if childStatus == SUCCESS:
+                        self.stopNode(n, SUCCESS)
+                    else:
+                        status[n] = childStatus
+                    return
+            self.stopNode(n, FAILURE)
+            self.current[n] = len(children) - 1
+
+        elif kind == PARALLEL:
+            if status[n] != RUNNING:
+                for child in children:
+                    if status[child] != INVALID:
+                        self.stopNode(child, INVALID)
+                self.current[n] = -1
+            synchronise = self.synchronise[n]
+            for child in children:
+                if synchronise and status[child] == SUCCESS:
+                    continue
+                self.tickNode(child)
+            newStatus = RUNNING
+            self.current[n] = len(children) - 1
+            for k in range(len(children)):
+                if status[children[k]] == FAILURE:
+                    self.current[n] = k
+                    newStatus = FAILURE
+                    break
+            else:
+                if self.params[n]:
+                    # Success on one
+                    for k in reversed(range(len(children))):
+                        if status[children[k]] == SUCCESS:
+                            newStatus = SUCCESS
+                            self.current[n] = k
+                            break
+                elif all(status[child] == SUCCESS for child in children):
+                    newStatus = SUCCESS
+            if newStatus != RUNNING:
+                self.stopNode(n, newStatus)
+            status[n] = newStatus
+
+        else:
+            # Decorators
+            child = children[0]
+            if status[n] != RUNNING:
+                self.count[n] = 0
+            self.tickNode(child)
+            childStatus = status[child]
+            if kind == RETRY:
+                if childStatus == FAILURE:
+                    self.count[n] += 1
+                    newStatus = RUNNING if self.count[n] < self.params[n] else FAILURE
+                elif childStatus == RUNNING:
+                    newStatus = RUNNING
+                else:
+                    newStatus = SUCCESS
+            elif kind == REPEAT:
+                if childStatus == FAILURE:
+                    newStatus = FAILURE
+                elif childStatus == SUCCESS:
+                    self.count[n] += 1
+                    newStatus = SUCCESS if self.count[n] == self.params[n] else RUNNING
+                else:
+                    newStatus = RUNNING
+            else:
+                if childStatus == SUCCESS:
+                    newStatus = FAILURE
+                elif childStatus == FAILURE:
+                    newStatus = SUCCESS
+                else:
+                    newStatus = childStatus
+            if newStatus != RUNNING:
+                self.stopNode(n, newStatus)
+            status[n] = newStatus
+
+    def stopNode(self, n, newStatus):
+        kind = self.kinds[n]
+        status = self.status
+        children = self.children[n]
+        if kind == LEAF:
+            if self.leafTerminate[n]:
+                self.leaves[n].terminate(STATUSES[newStatus])
+        elif kind == INVERTER or kind == RETRY or kind == REPEAT:
+            child = children[0]
+            if newStatus == INVALID:
+                self.stopNode(child, INVALID)
+            if status[child] == RUNNING:
+                self.stopNode(child, INVALID)
+        else:
+            if kind == PARALLEL:
+                for child in children:
+                    if status[child] == RUNNING:
+                        self.stopNode(child, INVALID)
+            if newStatus == INVALID:
+                self.current[n] = -1
+                for child in children:
+                    if status[child] != INVALID:
+                        self.stopNode(child, INVALID)
+        status[n] = newStatus
+
+    def syncStatus(self):
+        # Copy compiled statuses onto the py_trees nodes, e.g. so py_trees.display can render them.
+        for n in range(len(self.nodes)):
+            self.nodes[n].status = STATUSES[self.status[n]]
+
+    def mismatches(self, reference):
+        # Names of nodes whose status differs from the same node in reference, the root of an identical tree
+        # ticked by py_trees.
+        return [node.name for n, node in enumerate(preorder(reference)) if CODES[node.status] != self.status[n]]
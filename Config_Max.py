@@ -30,16 +30,40 @@ class SimLaw():
         else:
             self.render = True
 
+        # Early termination, all off by default. A run also ends when a criterion below holds, and its output row
+        # says which one did (Termination.py).
+        self.stopAtQuorum = 0  # share of the swarm at one target, e.g. 0.5
+        self.stopWhenRankingStable = 0  # steps without a change in the order of targets by agents at them
+        self.stopWhenOnlyUncommitted = False  # some agents are finished and everyone else is Uncommitted
+
         # Other General Parameters
         self.totalTime = -100
         self.dt = 1
         self.numSims = 1
         self.saveData = True
+        # Accepted values are "Columnar" (folder of column files, see ResultStore.py), "CSV" and "Both"
+        self.resultFormat = "Columnar"
+        # Should runs save a snapshot (Snapshot.py) every checkpointInterval steps? A run that finds a checkpoint of
+        # itself in checkpointFile carries on from it. 0 turns checkpoints off.
+        self.checkpointInterval = 0
+        self.checkpointFile = "Checkpoint_{simNumber}.snap"
+        # Should finished runs be stored in cacheDir and reused by later runs with the same settings and code?
+        # Lets an interrupted sweep pick up where it stopped, and overlapping sweeps only run what's new.
+        self.resultCache = False
+        self.cacheDir = "ResultCache"
         self.debugEveryStep = False
         self.debugEveryBypass = False
         self.debugStateChanges = False
-        self.printTree = False
-        self.frameSkip = 1  # visual only
+        self.printTree = False  # record BT statuses of treeAgents and write the last sample to BT.html after the run
+        self.treeAgents = [0]
+        self.treeInterval = 1  # steps between samples
+        self.treeCapacity = 1000  # samples kept
+        self.frameSkip = 1  # visual only. Grows on its own while the video encoder can't keep up.
+        self.displayRate = 60  # screen refreshes per second while rendering, independent of steps per second
+        # Should runs log every rendered frame to trajectoryFile? Trajectory.render_video turns the log into a video
+        # later, using every core, so sweeps can be watched without rendering while they run.
+        self.recordTrajectory = False
+        self.trajectoryFile = "Trajectory_{simNumber}.npz"
         self.playbackSpeed = 1
         self.simNumber = 0
         self.varValue = None
@@ -117,3 +141,31 @@ class SimLaw():
         self.committedTargetColor = (255, 255, 255)
         self.seeHazardColor = (255, 127, 127)
 
+        # Performance
+        # Accepted values are "Batched" (one vectorized pass per step), "Grid" (spatial hash queried every tick)
+        # and "PerAgent" (Utilities.findItem every tick)
+        self.perceptionMode = "Batched"
+        # Agents processed per block by the batched perception engine. Bounds memory to this many rows per pass.
+        # Swarms larger than one block find neighbors through a cell list instead of comparing every pair.
+        self.perceptionChunkSize = 256
+        # Should waypoint checks look up hazards and bounds in a precomputed raster? Waypoints near a hazard get
+        # pushed along the raster's repulsion direction, which is accurate to about one cell.
+        self.staticField = False
+        self.staticFieldResolution = 10  # cells per meter
+        # Should agent positions, headings and other per-agent values be stored as float32 instead of float64?
+        self.stateFloat32 = False
+        # Accepted values are "py_trees" (reference), "Compiled" (flat executor in CompiledBT.py), "CrossCheck",
+        # which runs both on the same seed and stops with an error at the first step where they differ, and "Batched",
+        # which ticks all agents together leaf by leaf (BatchedBT.py).
+        self.btEngine = "py_trees"
+        # Should state transitions and deaths come from a clock sampled once per state instead of a roll every step?
+        # Same distribution, but draws different random numbers than rolling.
+        self.presampledTransitions = False
+        # Should runs jump over stretches where every live agent is Uncommitted, straight to the step where the first
+        # presampled clock runs out? Gives the results of ticking every step. Needs presampledTransitions, and has no
+        # effect on rendered, tree-recorded or trajectory-recorded runs, which look at every step.
+        self.skipIdle = False
+        # Should multiLaw runs that differ only in rngSeed share one process and advance together (Lockstep.py)?
+        # Replicates always use the batched engines, so results match btEngine and perceptionMode "Batched".
+        self.lockstep = False
+
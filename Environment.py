@@ -1,6 +1,8 @@
 import random
 import numpy as np
 import pygame.draw
+import Render
+from StaticField import StaticField
 
 
 class Environment:
@@ -72,8 +74,14 @@ class Environment:
         # Premake all hazards and targets
         # self.numKnownTargets = min(len(self.targetCoords), sl.numTargets)
         self.targets = [Target(sl, coord, False, True) for coord in self.targetCoords]
+        for j in range(len(self.targets)):
+            self.targets[j].ID = j
         # self.numKnownHazards = min(len(self.hazardCoords), self.numHazards)
         self.hazards = [Hazard(sl, coord, False) for coord in self.hazardCoords]
+        for j in range(len(self.hazards)):
+            self.hazards[j].ID = j
+        # Precomputed raster of hazards and bounds, shared by every run with the same layout
+        self.staticField = StaticField.get(sl, self) if sl.staticField else None
 
         # Random placement of hazards and targets temporarily disabled
         # # Force-spawn the known hazards and targets
@@ -125,6 +133,22 @@ class Environment:
         #         break
 
     def renderEnvironment(self, sl, screen, step):
+        # Home, hazards and targets don't move, so they come from a cached background
+        screen.blit(Render.background(sl, self, screen.get_size()), (0, 0))
+
+        # Draw Time
+        total_seconds = sl.dt * step
+        current_second = int(total_seconds % 60)
+        total_minutes = np.floor(total_seconds / 60)
+        current_minute = int(total_minutes % 60)
+        total_hours = int(np.floor(total_minutes / 60))
+        timeString = str(total_hours) + ":" + str(current_minute).zfill(2) + ":" + str(current_second).zfill(2)
+        text_ID = Render.text(f"{timeString}", (255, 255, 255), 30)
+        screen.blit(text_ID, (self.width - 100, 0))
+
+        return
+
+    def renderStatic(self, sl, screen):
         # Draw Home
         if sl.homeExists:
             home = self.home
@@ -154,8 +178,7 @@ class Environment:
             )
             # hazard ID
             if sl.renderFlavor:
-                font = pygame.font.SysFont('Arial', 16)
-                text_ID = font.render(f"{i}", True, (255, 255, 255))
+                text_ID = Render.text(f"{i}", (255, 255, 255))
                 screen.blit(text_ID, (sl.ppm * currentHazard.position[0], sl.ppm * currentHazard.position[1]))
 
         # Draw Targets
@@ -173,25 +196,11 @@ class Environment:
             )
             # target ID
             if sl.renderFlavor:
-                font = pygame.font.SysFont('Arial', 16)
-                text_ID = font.render(f"{i}", True, (255, 255, 255))
+                text_ID = Render.text(f"{i}", (255, 255, 255))
                 screen.blit(text_ID, (sl.ppm * currentTarget.position[0], sl.ppm * currentTarget.position[1]))
-                text_Quality = font.render(f"{int(100 * currentTarget.quality)}%", True, (255, 255, 255))
+                text_Quality = Render.text(f"{int(100 * currentTarget.quality)}%", (255, 255, 255))
                 screen.blit(text_Quality, (sl.ppm * currentTarget.position[0], sl.ppm * currentTarget.position[1] + 10))
 
-        # Draw Time
-        total_seconds = sl.dt * step
-        current_second = int(total_seconds % 60)
-        total_minutes = np.floor(total_seconds / 60)
-        current_minute = int(total_minutes % 60)
-        total_hours = int(np.floor(total_minutes / 60))
-        timeString = str(total_hours) + ":" + str(current_minute).zfill(2) + ":" + str(current_second).zfill(2)
-        font = pygame.font.SysFont('Arial', 30)
-        text_ID = font.render(f"{timeString}", True, (255, 255, 255))
-        screen.blit(text_ID, (self.width - 100, 0))
-
-        return
-
 class Home:
     def __init__(self, sl):
         self.sl = sl
@@ -0,0 +1,204 @@
+import copy
+import random
+import time
+import numpy as np
+import ResultCache
+from BatchedBT import BatchedBT
+from Environment import Environment
+from Perception import Perception
+from Simulator import outputRow
+from States import State
+from Swarm import Swarm, SwarmState
+from VisibilityGraph import VisibilityGraph
+
+
+def run_lockstep(simLaws):
+    # Pool-friendly entry point, returning one row per SimLaw like Simulator.run_simulations. Runs found in the result
+    # cache are not run again.
+    rows = [None] * len(simLaws)
+    remaining = []
+    for r in range(len(simLaws)):
+        sl = simLaws[r]
+        cached = ResultCache.load(batched(sl)) if sl.resultCache and sl.saveData else None
+        if cached is not None:
+            print(f"Run {sl.simNumber:3.0f} found in the result cache")
+            rows[r] = outputRow(sl, *cached)
+        else:
+            remaining.append(r)
+    if remaining:
+        for r, row in zip(remaining, Lockstep([simLaws[r] for r in remaining]).run()):
+            rows[r] = row
+    return rows
+
+
+def batched(sl):
+    # The single-run settings that give the same results as running sl in lockstep
+    sl = copy.copy(sl)
+    sl.btEngine = "Batched"
+    sl.perceptionMode = "Batched"
+    return sl
+
+
+class Lockstep:
+    # Runs replicates of one configuration side by side in a single process. simLaws may differ only in rngSeed,
+    # simNumber and varValue. All replicates' agents are rows of one SwarmState, replicate r owning rows
+    # r * numAgents onwards, so one perception pass and one batched behaviour tree tick per step cover every replicate.
+    # Each replicate has its own Environment and its own random module, numpy and spawn streams, so its results are
+    # the ones Simulator.run_simulations gives for its SimLaw with btEngine "Batched" and perceptionMode "Batched".
+    def __init__(self, simLaws):
+        self.simLaws = simLaws
+        sl = batched(simLaws[0])
+        self.simlaw = sl
+        numAgents = sl.numAgents
+        numReplicates = len(simLaws)
+        self.swarmState = SwarmState(sl, numReplicates * numAgents, [])
+
+        self.swarms = []
+        randomStates = []
+        for r in range(numReplicates):
+            replicateSl = copy.copy(simLaws[r])
+            # Trees are built per replicate but ticked by the shared engine below
+            replicateSl.btEngine = "py_trees"
+            replicateSl.perceptionMode = "Batched"
+            replicateSl.printTree = False
+            random.seed(replicateSl.rngSeed)
+            environment = Environment(replicateSl)
+            rows = self.swarmState.rows(r * numAgents, (r + 1) * numAgents, environment.targets)
+            self.swarms.append(Swarm(replicateSl, environment, rows))
+            randomStates.append(random.getstate())
+        # The layout doesn't depend on the seed, so every replicate's geometry is the same as the first one's
+        self.environment = self.swarms[0].environment
+        self.agents = [agent for swarm in self.swarms for agent in swarm.agents]
+        self.replicateOf = np.repeat(np.arange(numReplicates), numAgents)
+
+        self.visibility = VisibilityGraph(len(self.agents))
+        self.perception = Perception(sl, self)
+        stride = 2 * (sl.mapWidth + sl.visualRange)
+        self.perception.cellOffsets = np.column_stack((self.replicateOf * stride, np.zeros(len(self.agents))))
+        self.perception.agentTargets = [swarm.environment.targets for swarm in self.swarms for _ in swarm.agents]
+        for r in range(numReplicates):
+            self.swarms[r].visibility = ReplicateGraph(self.visibility, r * numAgents)
+
+        self.batchedBT = BatchedBT(self, [bt for swarm in self.swarms for bt in swarm.BTs],
+                                   [replicateSl.rngSeed for replicateSl in simLaws])
+        self.batchedBT.randomStates = randomStates
+
+    def stepSimulation(self, step):
+        # Advances every replicate by one step. Returns the state counts of each replicate.
+        sl = self.simlaw
+        numAgents = sl.numAgents
+        perception = self.perception
+        perception.update(step)
+        # Each replicate's leaves read perception through their own swarm
+        for r in range(len(self.swarms)):
+            rows = slice(r * numAgents, (r + 1) * numAgents)
+            replicate = self.swarms[r].perception
+            replicate.localAgentLists = perception.localAgentLists[rows]
+            replicate.localTargetLists = perception.localTargetLists[rows]
+            replicate.localHazardLists = perception.localHazardLists[rows]
+            replicate.step = step
+        self.batchedBT.step()
+
+        counts = np.bincount(self.replicateOf * len(State) + self.swarmState.states,
+                             minlength=len(self.swarms) * len(State)).reshape(len(self.swarms), len(State))
+        for r in range(len(self.swarms)):
+            swarm = self.swarms[r]
+            swarm.swarmState.stateCounts[:] = counts[r]
+            finished = counts[r, State.Done] + counts[r, State.Dead] == numAgents
+            if swarm.termination is not None and swarm.stopReason is None and not finished:
+                swarm.stopReason = swarm.termination.check(swarm.swarmState, swarm.targets)
+        return counts
+
+    def run(self):
+        # Steps all replicates until each one is done, and returns their rows. Final steps follow the two modes of
+        # Simulator.run_simulations.
+        sl = self.simlaw
+        startTime = time.time()
+        numReplicates = len(self.swarms)
+        print(f"Starting Simulations {self.simLaws[0].simNumber} to {self.simLaws[-1].simNumber} in lockstep")
+        finalSteps = np.full(numReplicates, -1)
+        # Agents at each target and stop reason of each replicate when it finished. Replicates stopped early keep
+        # stepping with the others, so their targets can change afterwards.
+        finalTargets = [None] * numReplicates
+        stopReasons = [None] * numReplicates
+
+        if sl.totalTime <= 0:
+            step = 1
+            while np.any(finalSteps < 0):
+                counts = self.stepSimulation(step)
+                done = self.finished(counts) & (finalSteps < 0)
+                finalSteps[done] = step + 1
+                self.finish(done, finalTargets, stopReasons)
+                self.report(step, done, startTime)
+                step += 1 + self.skipIdle(np.inf)
+        else:
+            steps = int(sl.totalTime / sl.dt)
+            # Steps before nextStep were skipped as idle
+            nextStep = 0
+            for step in range(steps):
+                if np.all(finalSteps >= 0):
+                    break
+                if step < nextStep:
+                    continue
+                counts = self.stepSimulation(step)
+                done = self.finished(counts) & (finalSteps < 0)
+                finalSteps[done] = min(step + 1, steps - 1)
+                self.finish(done, finalTargets, stopReasons)
+                self.report(step, done, startTime)
+                nextStep = step + 1 + self.skipIdle(steps - 1 - step)
+            self.finish(finalSteps < 0, finalTargets, stopReasons, "TimeLimit")
+            finalSteps[finalSteps < 0] = steps - 1
+
+        if not sl.saveData:
+            return [None] * numReplicates
+        rows = []
+        for r in range(numReplicates):
+            step = int(finalSteps[r])
+            if self.simLaws[r].resultCache:
+                ResultCache.store(batched(self.simLaws[r]), step, finalTargets[r], stopReasons[r])
+            rows.append(outputRow(self.simLaws[r], step, finalTargets[r], stopReasons[r]))
+        return rows
+
+    def skipIdle(self, limit):
+        # Skips the coming steps that every replicate is idle in (Swarm.idleSteps), if skipIdle is on. Returns how
+        # many were skipped.
+        if not self.simlaw.skipIdle:
+            return 0
+        steps = min(swarm.idleSteps(swarm.simlaw, limit) for swarm in self.swarms)
+        for swarm in self.swarms:
+            swarm.skipIdle(swarm.simlaw, steps)
+        return steps
+
+    def finished(self, counts):
+        # Which replicates are done or were stopped early
+        stopped = np.array([swarm.stopReason is not None for swarm in self.swarms])
+        return (counts[:, State.Done] + counts[:, State.Dead] == self.simlaw.numAgents) | stopped
+
+    def finish(self, replicates, finalTargets, stopReasons, reason="Done"):
+        for r in np.flatnonzero(replicates):
+            finalTargets[r] = [target.numAgents for target in self.swarms[r].environment.targets]
+            stopReasons[r] = self.swarms[r].stopReason or reason
+
+    def report(self, step, done, startTime):
+        for r in np.flatnonzero(done):
+            print(f"Done with Run {self.simLaws[r].simNumber:3.0f}, took {time.time() - startTime:3.2f}s")
+        if step % 100 == 0 and self.simlaw.printProgress:
+            numDone = sum(swarm.swarmState.stateCounts[State.Done] for swarm in self.swarms)
+            print(f"{step:4.0f} steps through lockstep runs, {numDone:3.0f} are done")
+
+
+class ReplicateGraph:
+    # One replicate's part of the shared visibility graph, in the replicate's own agent numbers
+    def __init__(self, graph, base):
+        self.graph = graph
+        self.base = base
+
+    def sees(self, agentNum):
+        return self.graph.sees(agentNum + self.base) - self.base
+
+    def seenBy(self, agentNum):
+        return self.graph.seenBy(agentNum + self.base) - self.base
+
+    def edgesFrom(self, agentNums):
+        k, j = self.graph.edgesFrom(agentNums + self.base)
+        return k, j - self.base
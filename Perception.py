@@ -0,0 +1,161 @@
+import numpy as np
+from Utilities import Utilities as U
+from SpatialHash import SpatialHash
+
+
+class Perception:
+    # Computes what every agent can see in one batched pass per step, instead of looping over the swarm per agent.
+    # DetectObject and CheckForTarget read their lists from here.
+    def __init__(self, sl, swarm):
+        self.sl = sl
+        self.swarm = swarm
+        self.mode = sl.perceptionMode
+        # Rows of agents processed per block, so memory stays bounded at chunkSize * numAgents entries.
+        # Swarms larger than one block switch to cell-list candidate pairs for agent-agent visibility.
+        self.chunkSize = max(1, sl.perceptionChunkSize)
+        # An item is inside the FOV if the angle to it is at most FOV/2, i.e. if cos(angle) >= cos(FOV/2).
+        self.cosHalfFOV = np.cos(min(sl.FOV / 2, np.pi))
+        self.step = None
+
+        env = swarm.environment
+        self.targetPositions = np.array([t.position[:2] for t in env.targets], dtype=float).reshape(-1, 2)
+        self.targetRanges = sl.visualRange + np.array([t.radius for t in env.targets], dtype=float)
+        self.hazardPositions = np.array([h.position[:2] for h in env.hazards], dtype=float).reshape(-1, 2)
+        self.hazardRanges = sl.visualRange + np.array([h.radius for h in env.hazards], dtype=float)
+
+        numAgents = len(swarm.agents)
+        self.localAgentLists = [[] for _ in range(numAgents)]
+        self.localTargetLists = [[] for _ in range(numAgents)]
+        self.localHazardLists = [[] for _ in range(numAgents)]
+        # Optional (numAgents, 2) offsets added to positions when agents are sorted into cells. Lockstep runs use them
+        # to place replicates sharing one pass far enough apart that no pair across replicates is ever tested.
+        self.cellOffsets = None
+        # Target list each agent's localTargets come from. Lockstep replicates each have their own Target objects.
+        self.agentTargets = [env.targets] * numAgents
+
+        # Grid mode answers each query at tick time from spatial hashes, which CommitNextWP keeps up to date.
+        self.agentHash = None
+        self.targetHash = None
+        self.hazardHash = None
+        if self.mode == "Grid":
+            self.agentHash = SpatialHash(sl.visualRange)
+            for agent in swarm.agents:
+                self.agentHash.insert(agent.ID, agent.position)
+            self.targetHash = SpatialHash(sl.visualRange)
+            for j in range(env.numTargets):
+                self.targetHash.insertRegion(j, env.targets[j].position, self.targetRanges[j])
+            self.hazardHash = SpatialHash(sl.visualRange)
+            for j in range(env.numHazards):
+                self.hazardHash.insertRegion(j, env.hazards[j].position, self.hazardRanges[j])
+
+    def update(self, step):
+        # Batched mode takes one snapshot of the swarm at the start of each step.
+        if self.mode != "Batched" or self.step == step:
+            return
+        self.step = step
+        swarm = self.swarm
+        env = swarm.environment
+        agents = swarm.agents
+        positions = swarm.swarmState.positions[:, :2].astype(float)
+        headings = swarm.swarmState.headings.astype(float)
+        # Forward unit vectors. Second component is negative because pygame flips y-axis
+        forward = np.column_stack((np.cos(headings), -np.sin(headings)))
+        denseAgents = len(agents) <= self.chunkSize and self.cellOffsets is None
+        iParts = [np.zeros(0, dtype=np.int64)]
+        jParts = [np.zeros(0, dtype=np.int64)]
+
+        for start in range(0, len(agents), self.chunkSize):
+            stop = min(start + self.chunkSize, len(agents))
+            pos = positions[start:stop]
+            fwd = forward[start:stop]
+
+            seeTargets = self.visible(pos, fwd, self.targetPositions, self.targetRanges)
+            seeHazards = self.visible(pos, fwd, self.hazardPositions, self.hazardRanges)
+            if denseAgents:
+                rows, cols = np.nonzero(self.visible(pos, fwd, positions, self.sl.visualRange))
+                iParts.append(rows + start)
+                jParts.append(cols)
+            for row in range(stop - start):
+                targets = self.agentTargets[start + row]
+                self.localTargetLists[start + row] = [targets[j] for j in np.flatnonzero(seeTargets[row])]
+                self.localHazardLists[start + row] = [env.hazards[j] for j in np.flatnonzero(seeHazards[row])]
+
+        if not denseAgents:
+            # Only test pairs in the same or adjacent cells, so the cost grows with agents, not agents squared.
+            cellPositions = positions if self.cellOffsets is None else positions + self.cellOffsets
+            i, j = SpatialHash.candidatePairs(cellPositions, self.sl.visualRange)
+            diff = positions[j] - positions[i]
+            dist = np.hypot(diff[:, 0], diff[:, 1])
+            dot = diff[:, 0] * forward[i, 0] + diff[:, 1] * forward[i, 1]
+            seen = (dist <= self.sl.visualRange) & (dist > 0) & (dot >= self.cosHalfFOV * dist)
+            iParts.append(i[seen])
+            jParts.append(j[seen])
+
+        graph = swarm.visibility
+        graph.build(np.concatenate(iParts).astype(np.int64), np.concatenate(jParts).astype(np.int64))
+        indices = graph.seesIndices.tolist()
+        indptr = graph.seesIndptr.tolist()
+        for k in range(len(agents)):
+            self.localAgentLists[k] = [agents[m] for m in indices[indptr[k]:indptr[k + 1]]]
+
+    def visible(self, pos, fwd, itemPositions, itemRanges):
+        # Returns a (len(pos), len(itemPositions)) mask of items in range and inside the FOV.
+        diff = itemPositions[None, :, :] - pos[:, None, :]
+        dist = np.hypot(diff[:, :, 0], diff[:, :, 1])
+        dot = diff[:, :, 0] * fwd[:, None, 0] + diff[:, :, 1] * fwd[:, None, 1]
+        # Items sitting exactly on the agent (including the agent itself) are never seen, matching Utilities.isNear
+        return (dist <= itemRanges) & (dist > 0) & (dot >= self.cosHalfFOV * dist)
+
+    def agentMoved(self, agent):
+        if self.agentHash is not None:
+            self.agentHash.move(agent.ID, agent.position)
+
+    def gridQuery(self, agentNum, candidates, itemPositions, itemRanges):
+        # Tests only the candidates from the spatial hash, using the agent's current position and heading.
+        if not candidates:
+            return []
+        agent = self.swarm.agents[agentNum]
+        pos = np.array([agent.position[:2]], dtype=float)
+        fwd = np.array([[np.cos(agent.heading), -np.sin(agent.heading)]])
+        seen = self.visible(pos, fwd, itemPositions, itemRanges)[0]
+        return [candidates[k] for k in np.flatnonzero(seen)]
+
+    def localAgents(self, agentNum):
+        if self.mode == "Batched":
+            return self.localAgentLists[agentNum]
+        elif self.mode == "Grid":
+            agents = self.swarm.agents
+            candidates = [j for j in self.agentHash.nearby(agents[agentNum].position) if j != agentNum]
+            positions = self.swarm.swarmState.positions[candidates, :2].astype(float)
+            seen = self.gridQuery(agentNum, candidates, positions, self.sl.visualRange)
+            return [agents[j] for j in seen]
+        return U.findItem(self.swarm, agentNum, self.sl, "Agents")
+
+    def seenBy(self, agentNum):
+        # Agents whose neighbor list contains agentNum. Batched mode reads the visibility graph. The other modes scan
+        # every agent's list, since agents later in the tick order still hold last step's lists.
+        agents = self.swarm.agents
+        if self.mode == "Batched":
+            return [agents[j] for j in self.swarm.visibility.seenBy(agentNum).tolist()]
+        agent = agents[agentNum]
+        return [other for other in agents if agent in other.neighbors]
+
+    def localTargets(self, agentNum):
+        if self.mode == "Batched":
+            return self.localTargetLists[agentNum]
+        elif self.mode == "Grid":
+            candidates = self.targetHash.atCell(self.swarm.agents[agentNum].position)
+            seen = self.gridQuery(agentNum, candidates,
+                                  self.targetPositions[candidates], self.targetRanges[candidates])
+            return [self.swarm.environment.targets[j] for j in seen]
+        return U.findItem(self.swarm, agentNum, self.sl, "Targets")
+
+    def localHazards(self, agentNum):
+        if self.mode == "Batched":
+            return self.localHazardLists[agentNum]
+        elif self.mode == "Grid":
+            candidates = self.hazardHash.atCell(self.swarm.agents[agentNum].position)
+            seen = self.gridQuery(agentNum, candidates,
+                                  self.hazardPositions[candidates], self.hazardRanges[candidates])
+            return [self.swarm.environment.hazards[j] for j in seen]
+        return U.findItem(self.swarm, agentNum, self.sl, "Hazards")
@@ -0,0 +1,77 @@
+import weakref
+import numpy as np
+import pygame
+
+# Outlines of the agent appearances in units of agentSize, heading along +x. Triangles repeat their first point to close.
+SHAPES = {"cross": np.array([[1, 1], [-1, -1], [0, 0], [1, -1], [-1, 1]], dtype=float),
+          "triangle": np.array([[1, 0], [-1, -0.8], [-1, 0.8], [1, 0]], dtype=float)}
+# Rendered text kept for reuse. Cleared when full, since labels like times in state keep changing.
+MAX_GLYPHS = 4096
+
+fonts = {}
+glyphs = {}
+# Static part of each environment's picture, by environment. Kept out of Environment so snapshots can pickle it.
+backgrounds = weakref.WeakKeyDictionary()
+
+
+def font(size):
+    if size not in fonts:
+        fonts[size] = pygame.font.SysFont('Arial', size)
+    return fonts[size]
+
+
+def text(string, color, size=16):
+    key = (string, color, size)
+    glyph = glyphs.get(key)
+    if glyph is None:
+        if len(glyphs) >= MAX_GLYPHS:
+            glyphs.clear()
+        glyph = font(size).render(string, True, color)
+        glyphs[key] = glyph
+    return glyph
+
+
+def background(sl, environment, size):
+    # Home, hazards and targets drawn once onto a surface of the screen's size
+    surface = backgrounds.get(environment)
+    if surface is None or surface.get_size() != size:
+        surface = pygame.Surface(size)
+        surface.fill((0, 0, 0))
+        environment.renderStatic(sl, surface)
+        backgrounds[environment] = surface
+    return surface
+
+
+def agentPolygons(sl, positions, headings, size):
+    # Screen points of every agent's outline at once, as an array of (agents, points, 2)
+    shape = SHAPES[sl.agentAppearance] * size
+    cos = np.cos(headings)[:, None]
+    sin = np.sin(headings)[:, None]
+    x = shape[:, 0] * cos - shape[:, 1] * sin
+    y = -shape[:, 0] * sin - shape[:, 1] * cos
+    return np.stack((sl.ppm * (positions[:, 0, None] + x), sl.ppm * (positions[:, 1, None] + y)), axis=2)
+
+
+def clear():
+    # Fonts die with pygame.quit(), so everything cached is dropped with them
+    fonts.clear()
+    glyphs.clear()
+    backgrounds.clear()
+
+
+def waitForKey(swarm, video_writer):
+    # Blocks while a render is paused until a key or window event comes in. Returns True if the right arrow asked
+    # for a single step.
+    event = pygame.event.wait()
+    if event.type == pygame.KEYDOWN:
+        if event.key == pygame.K_SPACE:
+            swarm.simulation_running = True
+        if event.key == pygame.K_RIGHT:
+            return True
+        elif event.key == pygame.K_ESCAPE:
+            video_writer.release()
+            pygame.quit()
+    elif event.type == pygame.WINDOWCLOSE:
+        video_writer.release()
+        pygame.quit()
+    return False
@@ -0,0 +1,79 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+# SimLaw fields that don't change what a run computes: display, logging, bookkeeping and caching settings
+IGNORED_FIELDS = {"SLs", "multiLaw", "render", "renderFlavor", "printProgress", "numSims", "saveData",
+                  "debugEveryStep", "debugEveryBypass", "debugStateChanges", "printTree", "treeAgents",
+                  "treeInterval", "treeCapacity", "frameSkip", "playbackSpeed", "simNumber", "varValue",
+                  "agentAppearance", "pixelsPerMeter", "ppm", "lockstep", "resultCache", "cacheDir", "resultFormat",
+                  "checkpointInterval", "checkpointFile", "recordTrajectory", "trajectoryFile", "skipIdle"}
+# Engines that give the same results as another one
+SAME_ENGINES = {"Compiled": "py_trees", "CrossCheck": "py_trees"}
+# Source files that don't change what a run computes
+IGNORED_SOURCES = {"masterScript.py", "MultiLaw.py", "Scheduler.py", "ResultCache.py", "BTRecorder.py"}
+
+codeVersion = None
+
+
+def getCodeVersion():
+    # Hash of the simulation's source files, so editing the code invalidates earlier results.
+    # Configuration files are left out, since the values they set are part of the key already.
+    global codeVersion
+    if codeVersion is None:
+        digest = hashlib.sha256()
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(glob.glob(os.path.join(folder, "*.py"))):
+            name = os.path.basename(filename)
+            if name in IGNORED_SOURCES or name.startswith("Config_"):
+                continue
+            digest.update(name.encode())
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        codeVersion = digest.hexdigest()[:16]
+    return codeVersion
+
+
+def fields(sl):
+    # The settings a run's outcome depends on
+    settings = {}
+    for name, value in vars(sl).items():
+        if name in IGNORED_FIELDS or name.endswith("Color"):
+            continue
+        if isinstance(value, range):
+            value = list(value)
+        settings[name] = value
+    settings["btEngine"] = SAME_ENGINES.get(settings["btEngine"], settings["btEngine"])
+    return settings
+
+
+def key(sl):
+    text = json.dumps({"code": getCodeVersion(), "fields": fields(sl)}, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def path(sl):
+    return os.path.join(sl.cacheDir, key(sl) + ".json")
+
+
+def load(sl):
+    # (final step, agents at each target, stop reason) of an earlier identical run, or None
+    try:
+        with open(path(sl)) as f:
+            outcome = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return outcome["step"], outcome["targets"], outcome["stopReason"]
+
+
+def store(sl, step, targets, stopReason):
+    # Written to a temporary file and renamed, so readers never see a partial entry
+    os.makedirs(sl.cacheDir, exist_ok=True)
+    outcome = {"step": int(step), "targets": [int(n) for n in targets], "stopReason": stopReason,
+               "code": getCodeVersion(), "fields": fields(sl)}
+    handle, temporary = tempfile.mkstemp(dir=sl.cacheDir, suffix=".tmp")
+    with os.fdopen(handle, 'w') as f:
+        json.dump(outcome, f, sort_keys=True, default=str)
+    os.replace(temporary, path(sl))
@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import time
+import numpy as np
+import Termination
+
+# Written into padded target columns of runs with fewer targets than the widest run
+MISSING = -1
+
+
+class ResultWriter:
+    # Buffers result rows and appends them to a columnar store: a folder holding schema.json and one raw binary file
+    # per column. Columns are the sim number, each varied MultiLaw variable, the final step, why the run stopped and the
+    # agents at each target, padded to the largest numTargets with MISSING. Text variables such as hazardType are stored as codes
+    # into their list of values. Rows are flushed and synced to disk every flushRows rows or flushSeconds seconds,
+    # so at most flushRows rows are held in memory and a crash loses at most one flush interval.
+    # With csvFilename set, the same rows also go to a CSV file with a header. With folder None, only the CSV file
+    # is written.
+    def __init__(self, folder, varNames, varValues, numTargets, csvFilename=None, flushRows=100, flushSeconds=30):
+        self.folder = folder
+        self.varNames = list(varNames)
+        self.numTargets = numTargets
+        self.csvFilename = csvFilename
+        self.flushRows = flushRows
+        self.flushSeconds = flushSeconds
+
+        self.columns = [("simNumber", "int64", None)]
+        for name, values in zip(varNames, varValues):
+            values = list(values)
+            if all(isinstance(value, (int, np.integer)) for value in values):
+                self.columns.append((name, "int64", None))
+            elif all(isinstance(value, (int, float, np.number)) for value in values):
+                self.columns.append((name, "float64", None))
+            else:
+                self.columns.append((name, "int32", [str(value) for value in values]))
+        self.columns.append(("steps", "int64", None))
+        self.columns.append(("stopReason", "int8", list(Termination.REASONS)))
+        for k in range(numTargets):
+            self.columns.append((f"target{k}", "int32", None))
+        self.names = [name for name, _, _ in self.columns]
+
+        self.files = []
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            schema = {"columns": [{"name": name, "dtype": dtype, "categories": categories}
+                                  for name, dtype, categories in self.columns]}
+            with open(os.path.join(folder, "schema.json"), 'w') as f:
+                json.dump(schema, f, indent=1)
+            self.files = [open(os.path.join(folder, name + ".bin"), 'ab') for name in self.names]
+        if csvFilename is not None:
+            with open(csvFilename, 'a', newline='') as csvfile:
+                csv.writer(csvfile, delimiter=',').writerow(self.names)
+        self.pending = []
+        self.lastFlush = time.time()
+
+    def write(self, row):
+        # row is one output row of Simulator.run_simulations: [simNumber, varied values..., step, stop reason,
+        # targets...]
+        if row is None:
+            return
+        self.pending.append(row)
+        if len(self.pending) >= self.flushRows or time.time() - self.lastFlush >= self.flushSeconds:
+            self.flush()
+
+    def flush(self):
+        numVars = len(self.varNames)
+        rows = self.pending
+        if rows:
+            values = [[row[0] for row in rows]]
+            for i, (name, dtype, categories) in enumerate(self.columns[1:1 + numVars]):
+                column = [row[1 + i] for row in rows]
+                if categories is not None:
+                    column = [categories.index(str(value)) for value in column]
+                values.append(column)
+            values.append([row[1 + numVars] for row in rows])
+            values.append([Termination.REASONS.index(row[2 + numVars]) for row in rows])
+            targets = np.full((len(rows), self.numTargets), MISSING)
+            for r, row in enumerate(rows):
+                counts = row[3 + numVars:]
+                targets[r, :len(counts)] = counts
+            values.extend(targets.T)
+            for f, (name, dtype, _), column in zip(self.files, self.columns, values):
+                f.write(np.asarray(column, dtype=dtype).tobytes())
+            for f in self.files:
+                f.flush()
+                os.fsync(f.fileno())
+            if self.csvFilename is not None:
+                with open(self.csvFilename, 'a', newline='') as csvfile:
+                    writer = csv.writer(csvfile, delimiter=',')
+                    for row in rows:
+                        writer.writerow(row)
+        self.pending = []
+        self.lastFlush = time.time()
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+
+def load(folder, decode=True):
+    # Columns of a store as {name: array}, memory-mapped from disk. Text variables are turned back into their values
+    # unless decode is False. Rows of an interrupted flush, present in only some columns, are left out.
+    with open(os.path.join(folder, "schema.json")) as f:
+        columns = json.load(f)["columns"]
+    numRows = min(os.path.getsize(os.path.join(folder, column["name"] + ".bin")) // np.dtype(column["dtype"]).itemsize
+                  for column in columns)
+    data = {}
+    for column in columns:
+        filename = os.path.join(folder, column["name"] + ".bin")
+        values = np.memmap(filename, dtype=column["dtype"], mode='r', shape=(numRows,)) if numRows else \
+            np.zeros(0, dtype=column["dtype"])
+        if decode and column["categories"] is not None:
+            values = np.array(column["categories"], dtype=object)[values]
+        data[column["name"]] = values
+    return data
+
+
+def export_csv(folder, csvFilename):
+    # Writes a store out as CSV with a header, leaving padded target counts empty
+    data = load(folder)
+    names = list(data)
+    with open(csvFilename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=',')
+        writer.writerow(names)
+        for r in range(len(data["simNumber"])):
+            writer.writerow(["" if name.startswith("target") and data[name][r] == MISSING else data[name][r]
+                             for name in names])
@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+import numpy as np
+import Simulator
+
+# Prior weights of the cost model, on the features below. Only relative costs matter for scheduling, so the prior
+# only needs the right trends: more agents, immortal agents, slower agents and more targets all mean longer runs.
+PRIOR = np.array([0.0, 1.5, 0.5, 2.0, -1.0, 0.5])
+# How strongly the fitted weights are pulled towards PRIOR
+RIDGE = 1.0
+
+
+def features(sl):
+    # Log-linear cost features of one run: log cost = features . weights
+    return np.array([1.0,
+                     math.log(sl.numAgents),
+                     math.log(sl.lifespan) if sl.lifespan > 0 else 0.0,
+                     1.0 if sl.lifespan <= 0 else 0.0,
+                     math.log(sl.maxSpeed),
+                     math.log(max(1, sl.numTargets))])
+
+
+def run_each(simLaws):
+    # Runner for plain sweeps: every SimLaw of a job separately
+    return [Simulator.run_simulations(sl) for sl in simLaws]
+
+
+def run_chunk(task):
+    # Pool entry point. Runs each job of a chunk and returns (job number, rows, seconds) for each.
+    runner, chunk = task
+    results = []
+    for jobNum, simLaws in chunk:
+        startTime = time.time()
+        rows = runner(simLaws)
+        results.append((jobNum, rows, time.time() - startTime))
+    return results
+
+
+class Scheduler:
+    # Runs a sweep on a process pool, longest jobs first. A job is a list of positions in simLaws that one call of
+    # runner(simLaws) handles, returning one row per SimLaw. Job costs are estimated by a log-linear model of
+    # numAgents, lifespan, maxSpeed and numTargets, refitted as jobs finish. Cheap jobs are batched into chunks so
+    # short runs don't pay a round trip each, and chunks shrink towards the end of the sweep to keep the tail short.
+    # Chunks are handed out lazily, at most two per process in flight, so later picks use the refitted model.
+    def __init__(self, simLaws, jobs, runner=run_each, processes=1):
+        self.simLaws = simLaws
+        self.jobs = jobs
+        self.runner = runner
+        self.processes = processes
+        self.features = [np.array([features(simLaws[p]) for p in job]) for job in jobs]
+        self.weights = PRIOR.copy()
+        # Observed (features, log seconds per run) pairs
+        self.observedX = []
+        self.observedY = []
+
+    def estimate(self, jobNum):
+        return np.exp(self.features[jobNum] @ self.weights).sum()
+
+    def observe(self, jobNum, seconds):
+        job = self.jobs[jobNum]
+        for x in self.features[jobNum]:
+            self.observedX.append(x)
+            self.observedY.append(math.log(max(seconds / len(job), 1e-3)))
+        # Ridge regression towards the prior
+        X = np.array(self.observedX)
+        y = np.array(self.observedY)
+        A = X.T @ X + RIDGE * np.eye(len(PRIOR))
+        self.weights = np.linalg.solve(A, X.T @ y + RIDGE * PRIOR)
+
+    def nextChunk(self):
+        # Pending jobs from most to least expensive, taken while they fit in the chunk budget (at least one)
+        pending = sorted(self.pending)
+        costs = np.array([self.estimate(jobNum) for jobNum in pending])
+        budget = costs.sum() / (4 * self.processes)
+        chunk = []
+        total = 0.0
+        for k in np.argsort(-costs, kind='stable'):
+            if chunk and total + costs[k] > budget:
+                break
+            chunk.append(pending[k])
+            total += costs[k]
+        self.pending.difference_update(chunk)
+        return chunk
+
+    def feed(self):
+        # Chunks for the pool. The pool's task thread pulls from here, so waiting on a slot delays the next pick
+        # until a chunk finishes.
+        while True:
+            while not self.slots.acquire(timeout=0.1):
+                if self.closed:
+                    return
+            with self.lock:
+                if not self.pending or self.closed:
+                    return
+                chunk = self.nextChunk()
+            yield self.runner, [(jobNum, [self.simLaws[p] for p in self.jobs[jobNum]]) for jobNum in chunk]
+
+    def run(self, pool):
+        # Yields the rows of all runs in simLaws order, each as soon as every earlier row is in
+        self.pending = set(range(len(self.jobs)))
+        self.slots = threading.Semaphore(2 * self.processes)
+        self.lock = threading.Lock()
+        self.closed = False
+        rows = {}
+        nextPosition = 0
+        try:
+            for results in pool.imap_unordered(run_chunk, self.feed()):
+                self.slots.release()
+                for jobNum, jobRows, seconds in results:
+                    # Jobs this quick were served from the result cache and say nothing about cost
+                    if seconds > 0.1:
+                        with self.lock:
+                            self.observe(jobNum, seconds)
+                    rows.update(zip(self.jobs[jobNum], jobRows))
+                while nextPosition in rows:
+                    yield rows.pop(nextPosition)
+                    nextPosition += 1
+        finally:
+            self.closed = True
@@ -1,30 +1,58 @@
+import os
 import random
 
-import cv2
 import pygame
 import time
+import Render
+import ResultCache
+import Snapshot
+import Trajectory
 from Environment import Environment
+from VideoEncoder import VideoEncoder, Viewer
 from Swarm import Swarm
+from States import State
 import numpy as np
 
 
-def run_simulations(sl):
-    random.seed(sl.rngSeed)
+def run_simulations(sl, snapshot=None):
+    # With a snapshot from Snapshot.take, the run carries on from it with the values of sl instead of starting over
+    useCache = sl.resultCache and sl.saveData and not sl.render and snapshot is None
+    if useCache:
+        cached = ResultCache.load(sl)
+        if cached is not None:
+            print(f"Run {sl.simNumber:3.0f} found in the result cache")
+            return outputRow(sl, *cached)
     startTime = time.time()
     n = sl.simNumber
-    print(f"Starting Simulation {n}")
-    env = Environment(sl)
-    swarm = Swarm(sl, env)
+    # An earlier attempt at this very run left a checkpoint, so pick up from there
+    checkpointFile = sl.checkpointFile.format(simNumber=n) if sl.checkpointInterval > 0 else None
+    if snapshot is None and checkpointFile is not None and os.path.exists(checkpointFile):
+        checkpoint = Snapshot.load(checkpointFile)
+        if Snapshot.key(checkpoint) == ResultCache.key(sl):
+            snapshot = checkpoint
+    if snapshot is not None:
+        swarm, firstStep = Snapshot.restore(snapshot, sl)
+        env = swarm.environment
+        firstStep += 1
+        print(f"Resuming Simulation {n} at step {firstStep}")
+    else:
+        random.seed(sl.rngSeed)
+        print(f"Starting Simulation {n}")
+        env = Environment(sl)
+        swarm = Swarm(sl, env)
+        firstStep = None
+    trajectory = Trajectory.TrajectoryRecorder(swarm) if sl.recordTrajectory else None
     screen = None
-    clock = None
+    viewer = None
     oneMore = False
+    # Idle stretches can only be skipped when nothing needs to see every step
+    skipIdle = sl.skipIdle and not sl.render and trajectory is None and swarm.recorder is None
 
     # Pre sim render
     if sl.render:
         pygame.init()
         screen = pygame.display.set_mode((env.width, env.height))
         pygame.display.set_caption("Particle Simulation")
-        clock = pygame.time.Clock()
 
         y = str(time.gmtime().tm_year)
         M = str(time.gmtime().tm_mon).zfill(2)
@@ -35,45 +63,33 @@ def run_simulations(sl):
         video_filename = "Simulation_" + y + M + d + '_' + h + m + s + ".mp4"
         video_fps = 30
         video_size = (env.width, env.height)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer = cv2.VideoWriter(video_filename, fourcc, video_fps, video_size, isColor=True)
+        # Frames are encoded on a separate thread, and the screen refreshes at displayRate whatever the step rate
+        video_writer = VideoEncoder(video_filename, video_fps, video_size, sl.frameSkip)
+        viewer = Viewer(sl, swarm, screen, video_writer)
 
     # Mode 1: Run until Done. Dangerous for low populations, which take very long times to finish
     if sl.totalTime <= 0:
-        step = 1
+        step = 1 if firstStep is None else firstStep
         while not swarm.simulation_done:
             # Handle keypress inputs
             while not swarm.simulation_running and not oneMore:
                 if sl.render:
-                    for event in pygame.event.get():
-                        if event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_SPACE:
-                                swarm.simulation_running = True
-                            if event.key == pygame.K_RIGHT:
-                                oneMore = True
-                            elif event.key == pygame.K_ESCAPE:
-                                video_writer.release()
-                                pygame.quit()
-                        elif event.type == pygame.WINDOWCLOSE:
-                            video_writer.release()
-                            pygame.quit()
+                    oneMore = Render.waitForKey(swarm, video_writer)
 
             # Step Simulation
             swarm.stepSimulation(sl, step)
+            if trajectory is not None:
+                trajectory.record(step)
+            if checkpointFile is not None and step % sl.checkpointInterval == 0:
+                Snapshot.save(Snapshot.take(swarm, step), checkpointFile)
 
             # Render?
-            if sl.render and (step % sl.frameSkip == 0 or step == 1):
-                swarm.renderAll(sl, screen, clock, step, video_writer)
-                frame = pygame.surfarray.array3d(screen)
-                frame = cv2.cvtColor(frame.swapaxes(0, 1), cv2.COLOR_RGB2BGR)
-                video_writer.write(frame)
+            if sl.render:
+                viewer.update(step)
 
             # Report progress
             if step % 100 == 0 and sl.printProgress:
-                numDone = 0
-                for agent in swarm.agents:
-                    if agent.state == "Done":
-                        numDone = numDone + 1
+                numDone = swarm.swarmState.stateCounts[State.Done]
                 targetList = []
                 for target in swarm.environment.targets:
                     targetList.append(target.numAgents)
@@ -81,47 +97,47 @@ def run_simulations(sl):
                       f"target pop: {targetList}")
             if oneMore:
                 oneMore = False
+            if skipIdle:
+                skipped = swarm.idleSteps(sl, np.inf)
+                swarm.skipIdle(sl, skipped)
+                step += skipped
             step += 1
     # Mode 2: Run number of steps. Cuts off if time limit reached.
     else:
         steps = int(sl.totalTime / sl.dt)
-        for step in range(steps):
+        step = 0 if firstStep is None else firstStep
+        # Steps before nextStep were skipped as idle
+        nextStep = step
+        for step in range(step, steps):
             # cut if done
             if swarm.simulation_done:
                 break
+            if step < nextStep:
+                continue
 
             # Handle keypress inputs
             while not swarm.simulation_running and not oneMore:
                 if sl.render:
-                    for event in pygame.event.get():
-                        if event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_SPACE:
-                                swarm.simulation_running = True
-                            if event.key == pygame.K_RIGHT:
-                                oneMore = True
-                            elif event.key == pygame.K_ESCAPE:
-                                video_writer.release()
-                                pygame.quit()
-                        elif event.type == pygame.WINDOWCLOSE:
-                            video_writer.release()
-                            pygame.quit()
+                    oneMore = Render.waitForKey(swarm, video_writer)
 
             # Step Simulation
             swarm.stepSimulation(sl, step)
+            if trajectory is not None:
+                trajectory.record(step)
+            if checkpointFile is not None and step % sl.checkpointInterval == 0:
+                Snapshot.save(Snapshot.take(swarm, step), checkpointFile)
+            if skipIdle:
+                skipped = swarm.idleSteps(sl, steps - 1 - step)
+                swarm.skipIdle(sl, skipped)
+                nextStep = step + 1 + skipped
 
             # Render?
-            if sl.render and (step % sl.frameSkip == 0 or step == 1):
-                swarm.renderAll(sl, screen, clock, step, video_writer)
-                frame = pygame.surfarray.array3d(screen)
-                frame = cv2.cvtColor(frame.swapaxes(0, 1), cv2.COLOR_RGB2BGR)
-                video_writer.write(frame)
+            if sl.render:
+                viewer.update(step)
 
             # Report progress
             if step % (steps // 100) == 0:
-                numDone = 0
-                for agent in swarm.agents:
-                    if agent.state == "Done":
-                        numDone = numDone + 1
+                numDone = swarm.swarmState.stateCounts[State.Done]
                 targetList = []
                 for target in swarm.environment.targets:
                     targetList.append(target.numAgents)
@@ -136,14 +152,32 @@ def run_simulations(sl):
     if sl.render:
         video_writer.release()
         pygame.quit()
+        Render.clear()
+    if swarm.recorder is not None:
+        swarm.recorder.writeHtml('BT.html')
+    if trajectory is not None:
+        trajectory.save(sl.trajectoryFile.format(simNumber=n))
+    if checkpointFile is not None and os.path.exists(checkpointFile):
+        os.remove(checkpointFile)
     endTime = time.time()
     print(f"Done with Run {n:3.0f}, took {endTime-startTime:3.2f}s")
     if sl.saveData:
-        outputData = [n]
-        if sl.multiLaw:
-            for value in sl.varValue:
-                outputData.append(value)
-        outputData.append(step)
-        for target in swarm.environment.targets:
-            outputData.append(target.numAgents)
-        return outputData
+        targets = [target.numAgents for target in swarm.environment.targets]
+        stopReason = swarm.stopReason or ("Done" if swarm.simulation_done else "TimeLimit")
+        if useCache:
+            ResultCache.store(sl, step, targets, stopReason)
+        return outputRow(sl, step, targets, stopReason)
+
+
+def outputRow(sl, step, targets, stopReason):
+    # One csv row: simulation number, varied values for multiLaw runs, final step, why the run ended (one of
+    # Termination.REASONS), and agents at each target
+    outputData = [sl.simNumber]
+    if sl.multiLaw:
+        for value in sl.varValue:
+            outputData.append(value)
+    outputData.append(step)
+    outputData.append(stopReason)
+    for numAgents in targets:
+        outputData.append(numAgents)
+    return outputData
@@ -0,0 +1,87 @@
+import copy
+import copyreg
+import io
+import os
+import pickle
+import random
+import zlib
+import py_trees
+import ResultCache
+import Simulator
+
+# Length of the hex digest at the start of a snapshot
+KEY_LENGTH = 64
+
+# A snapshot is the complete state of a run after some step, as compressed bytes: the Swarm with its Environment,
+# SimLaw, agents, behaviour trees (py_trees nodes, compiled tables or batched arrays, whichever the engine uses),
+# presampled clocks and numpy generators, plus the random module's state. Restoring it and stepping on gives exactly
+# what the original run would have. The bytes start with the ResultCache key of the run's SimLaw, so a checkpoint can
+# be matched to its run without unpacking it.
+
+
+def setBehaviourState(node, state):
+    node.__dict__.update(state)
+    node.iterator = node.tick()
+
+
+class SwarmPickler(pickle.Pickler):
+    # py_trees nodes keep an unused generator from their own tick(), which can't be pickled. It's left out and made
+    # again on load.
+    def reducer_override(self, obj):
+        if isinstance(obj, py_trees.behaviour.Behaviour):
+            state = dict(obj.__dict__)
+            del state['iterator']
+            return copyreg.__newobj__, (type(obj),), state, None, None, setBehaviourState
+        return NotImplemented
+
+
+def take(swarm, step):
+    # Snapshot of a run just after stepSimulation(sl, step)
+    buffer = io.BytesIO()
+    SwarmPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(
+        {"swarm": swarm, "random": random.getstate(), "step": step})
+    return ResultCache.key(swarm.simlaw).encode() + zlib.compress(buffer.getvalue())
+
+
+def restore(snapshot, sl=None):
+    # Returns (swarm, step) and puts the random module back in its state at the snapshot. With sl given, its values
+    # replace the snapshot's SimLaw, so stepping on runs a variant of the original run. Values only read while setting
+    # up, such as numAgents, maxSpeed or the map layout, keep their snapshot values.
+    contents = pickle.loads(zlib.decompress(snapshot[KEY_LENGTH:]))
+    swarm = contents["swarm"]
+    if sl is not None:
+        swarm.simlaw.__dict__.update(vars(sl))
+    random.setstate(contents["random"])
+    return swarm, contents["step"]
+
+
+def key(snapshot):
+    # ResultCache key of the SimLaw the snapshot was taken with
+    return snapshot[:KEY_LENGTH].decode()
+
+
+def save(snapshot, filename):
+    # Written to a temporary file and renamed, so an interrupted save leaves the previous snapshot intact
+    temporary = filename + ".tmp"
+    with open(temporary, 'wb') as f:
+        f.write(snapshot)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, filename)
+
+
+def load(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def fork(snapshot, sl, variants):
+    # Runs one variant of sl per dict of {field: value} in variants, each continuing from the snapshot, and returns
+    # their output rows. The shared prefix up to the snapshot is only simulated once.
+    rows = []
+    for variant in variants:
+        variantSl = copy.copy(sl)
+        for name, value in variant.items():
+            setattr(variantSl, name, value)
+        rows.append(Simulator.run_simulations(variantSl, snapshot))
+    return rows
@@ -0,0 +1,99 @@
+import math
+import numpy as np
+
+
+class SpatialHash:
+    # Uniform grid of square cells. With cellSize >= visualRange, everything an agent can see lies in its own cell
+    # or one of the eight adjacent cells.
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {}
+        self.itemCells = {}
+
+    def cellOf(self, position):
+        return math.floor(position[0] / self.cellSize), math.floor(position[1] / self.cellSize)
+
+    def insert(self, ID, position):
+        cell = self.cellOf(position)
+        self.cells.setdefault(cell, set()).add(ID)
+        self.itemCells[ID] = cell
+
+    def remove(self, ID):
+        cell = self.itemCells.pop(ID)
+        self.cells[cell].discard(ID)
+
+    def move(self, ID, position):
+        # Called whenever an item moves. Only touches the cell lists if the item changed cells.
+        cell = self.cellOf(position)
+        oldCell = self.itemCells[ID]
+        if cell == oldCell:
+            return
+        self.cells[oldCell].discard(ID)
+        self.cells.setdefault(cell, set()).add(ID)
+        self.itemCells[ID] = cell
+
+    def nearby(self, position):
+        # IDs in the 3x3 block of cells around position, in ascending order
+        cx, cy = self.cellOf(position)
+        found = []
+        for x in range(cx - 1, cx + 2):
+            for y in range(cy - 1, cy + 2):
+                cell = self.cells.get((x, y))
+                if cell:
+                    found.extend(cell)
+        found.sort()
+        return found
+
+    def insertRegion(self, ID, position, reach):
+        # For static items seen from further away than one cell (targets and hazards, whose visibility range includes
+        # their radius). The item is registered in every cell within reach, so a lookup only needs the agent's own cell.
+        x0, y0 = self.cellOf([position[0] - reach, position[1] - reach])
+        x1, y1 = self.cellOf([position[0] + reach, position[1] + reach])
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self.cells.setdefault((x, y), set()).add(ID)
+
+    def atCell(self, position):
+        cell = self.cells.get(self.cellOf(position))
+        if not cell:
+            return []
+        return sorted(cell)
+
+    @staticmethod
+    def candidatePairs(positions, cellSize):
+        # Vectorized cell list. Returns arrays (i, j), sorted by i then j, of every pair i != j where j lies in the
+        # same or an adjacent cell to i.
+        n = len(positions)
+        cells = np.floor(positions[:, :2] / cellSize).astype(np.int64)
+        cells -= cells.min(axis=0)
+        # Pad by one cell on each side so neighbor keys never wrap around
+        width = cells[:, 1].max() + 3
+        keys = (cells[:, 0] + 1) * width + (cells[:, 1] + 1)
+        order = np.argsort(keys, kind='stable')
+        sortedKeys = keys[order]
+
+        iParts = []
+        jParts = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighborKeys = keys + dx * width + dy
+                start = np.searchsorted(sortedKeys, neighborKeys, side='left')
+                counts = np.searchsorted(sortedKeys, neighborKeys, side='right') - start
+                total = counts.sum()
+                if total == 0:
+                    continue
+                # Expand each [start, start + count) range into indices into order
+                firsts = np.cumsum(counts) - counts
+                idx = np.repeat(start - firsts, counts) + np.arange(total)
+                iParts.append(np.repeat(np.arange(n), counts))
+                jParts.append(order[idx])
+
+        if not iParts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        i = np.concatenate(iParts)
+        j = np.concatenate(jParts)
+        keep = i != j
+        i = i[keep]
+        j = j[keep]
+        sort = np.lexsort((j, i))
+        return i[sort], j[sort]
@@ -0,0 +1,16 @@
+from enum import IntEnum
+
+
+class State(IntEnum):
+    # Agent states, stored as small integers in SwarmState. Names match the strings used in older output.
+    Uncommitted = 0
+    Exploring = 1
+    Assessing = 2
+    Recruiting = 3
+    Surveying = 4
+    Done = 5
+    Dead = 6
+
+
+# Indexing this tuple is much faster than calling State(code)
+STATES = tuple(State)
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class StaticField:
+    # Raster of the static environment, built once per layout. Targets, hazards and home never move after
+    # Environment.__init__, so each cell stores:
+    #   clearance: signed distance to the nearest hazard boundary or map edge, minus hazardClearance.
+    #              Positive means a waypoint there can't be inside any hazard's clearance or out of bounds.
+    #   nearestHazard: index of the nearest hazard, or -1 if there are none
+    #   repulsion: unit vector pointing directly away from the nearest hazard's center
+    # Fields are shared read-only between every run with the same layout in a process.
+    cache = {}
+
+    def __init__(self, sl, environment):
+        self.resolution = sl.staticFieldResolution
+        self.nx = int(np.ceil(sl.mapWidth * self.resolution))
+        self.ny = int(np.ceil(sl.mapHeight * self.resolution))
+        # Clearance is 1-Lipschitz, so anywhere in a cell it is at least the center value minus half the diagonal.
+        self.margin = 0.5 * np.sqrt(2) / self.resolution
+
+        xs = (np.arange(self.nx) + 0.5) / self.resolution
+        ys = (np.arange(self.ny) + 0.5) / self.resolution
+        x, y = np.meshgrid(xs, ys, indexing='ij')
+
+        boundDistance = np.minimum(np.minimum(x, sl.mapWidth - x), np.minimum(y, sl.mapHeight - y))
+        clearance = boundDistance - sl.hazardClearance
+        self.nearestHazard = -np.ones((self.nx, self.ny), dtype=np.int16)
+        self.repulsion = np.zeros((self.nx, self.ny, 2))
+        if environment.numHazards > 0:
+            centers = np.array([h.position[:2] for h in environment.hazards], dtype=float)
+            radii = np.array([h.radius for h in environment.hazards], dtype=float)
+            dx = x[:, :, None] - centers[:, 0]
+            dy = y[:, :, None] - centers[:, 1]
+            centerDistance = np.hypot(dx, dy)
+            hazardDistance = centerDistance - radii
+            self.nearestHazard = np.argmin(hazardDistance, axis=2).astype(np.int16)
+            clearance = np.minimum(clearance, hazardDistance.min(axis=2) - sl.hazardClearance)
+            pick = self.nearestHazard[:, :, None]
+            d = np.take_along_axis(centerDistance, pick, axis=2)[:, :, 0]
+            d[d == 0] = 1
+            self.repulsion[:, :, 0] = np.take_along_axis(dx, pick, axis=2)[:, :, 0] / d
+            self.repulsion[:, :, 1] = np.take_along_axis(dy, pick, axis=2)[:, :, 0] / d
+        self.clearance = clearance
+
+        for array in (self.clearance, self.nearestHazard, self.repulsion):
+            array.flags.writeable = False
+
+    @classmethod
+    def get(cls, sl, environment):
+        # Everything that moves hazards or map edges is part of the key. propQualityTargets sets the number of
+        # hazards when hazardType is "Partial".
+        key = (sl.numTargets, sl.hazardType, sl.hazardDistance, sl.hazardRadius, sl.hazardClearance,
+               sl.propQualityTargets, sl.mapWidth, sl.mapHeight, sl.staticFieldResolution)
+        if key not in cls.cache:
+            cls.cache[key] = cls(sl, environment)
+        return cls.cache[key]
+
+    def cellOf(self, position):
+        # Returns None outside the raster, where callers fall back to exact checks.
+        ix = int(position[0] * self.resolution)
+        iy = int(position[1] * self.resolution)
+        if position[0] < 0 or position[1] < 0 or ix >= self.nx or iy >= self.ny:
+            return None
+        return ix, iy
+
+    def isClear(self, position):
+        # True only if position is guaranteed to be outside every hazard's clearance and inside the bounds.
+        cell = self.cellOf(position)
+        return cell is not None and self.clearance[cell] > self.margin
+
+    def repulsionFrom(self, position, hazardIndex):
+        # Unit vector away from hazardIndex, or None if the raster's nearest hazard there is a different one.
+        cell = self.cellOf(position)
+        if cell is None or self.nearestHazard[cell] != hazardIndex:
+            return None
+        return self.repulsion[cell]
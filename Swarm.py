@@ -1,19 +1,33 @@
+import copy
+import math
 import numpy as np
 import pygame
 import random
 import py_trees
+import Render
 from AgentControllerBT import BT
+from CompiledBT import CompiledBT
+from BatchedBT import BatchedBT
+from BTRecorder import BTRecorder
+from Environment import Environment
+from Perception import Perception
+from VisibilityGraph import VisibilityGraph
+from States import State, STATES
+from Termination import Termination, enabled
 
 
 class Swarm:
-    def __init__(self, sl, environment):
+    def __init__(self, sl, environment, swarmState=None):
         # Merge Generation function with __init__
         super().__init__()
-        self.agents = [Agent(sl) for _ in range(sl.numAgents)]
+        spawnRNG = random.getstate()
+        # Lockstep runs pass in their replicate's rows of a shared SwarmState
+        if swarmState is None:
+            swarmState = SwarmState(sl, sl.numAgents, environment.targets)
+        self.swarmState = swarmState
+        self.agents = [Agent(sl, self.swarmState, i) for i in range(sl.numAgents)]
         self.simlaw = sl
         for i in range(sl.numAgents):
-            self.agents[i] = Agent(sl)
-            self.agents[i].sl = sl
             self.agents[i].position[0] = random.uniform(sl.spawnX[0], sl.spawnX[1])
             self.agents[i].position[1] = random.uniform(sl.spawnY[0], sl.spawnY[1])
             self.agents[i].position[2] = 0
@@ -27,84 +41,168 @@ class Swarm:
         self.thisAgent = 1
         self.environment = environment
         self.targets = environment.targets
-        self.dictionary = {'status': py_trees.common.Status.INVALID}
-        self.BTs = [BT(agent, self, sl, self.dictionary) for agent in self.agents]
+        self.visibility = VisibilityGraph(sl.numAgents)
+        self.perception = Perception(sl, self)
+        self.BTs = [BT(agent, self, sl) for agent in self.agents]
+        if sl.btEngine == "Compiled":
+            self.BTs = [CompiledBT(bt) for bt in self.BTs]
+        self.batchedBT = BatchedBT(self, self.BTs) if sl.btEngine == "Batched" else None
+        self.recorder = BTRecorder(self) if sl.printTree else None
+        # CrossCheck ticks this swarm with py_trees, and a shadow swarm built from the same seed with the compiled
+        # engine. Each swarm keeps its own copy of the random state, so both see the same random numbers.
+        self.shadow = None
+        if sl.btEngine == "CrossCheck":
+            mainRNG = random.getstate()
+            random.setstate(spawnRNG)
+            shadowSl = copy.copy(sl)
+            shadowSl.btEngine = "Compiled"
+            shadowSl.printTree = False
+            self.shadow = Swarm(shadowSl, Environment(shadowSl))
+            self.shadowRNG = random.getstate()
+            random.setstate(mainRNG)
         self.simulation_running = True
         self.simulation_done = False
+        if sl.skipIdle and not sl.presampledTransitions:
+            raise ValueError("skipIdle needs presampledTransitions")
+        # Opt-in early termination. stopReason names the criterion that ended the run, if one did.
+        self.termination = Termination(sl) if enabled(sl) else None
+        self.stopReason = None
+        # Colors indexed by state
+        self.stateColors = (sl.UColor, sl.EColor, sl.AColor, sl.RColor, sl.SColor, sl.DColor, sl.XColor)
         self.BT_States = [None] * sl.numAgents
 
     def stepSimulation(self, sl, step):
+        self.perception.update(step)
+        states = self.swarmState.states
+        if self.batchedBT is not None:
+            self.batchedBT.step()
         for i in range(sl.numAgents):
-            if not (self.agents[i].state == "Done" or self.agents[i].state == "Dead"):
+            if self.batchedBT is None and states[i] < State.Done:
                 # Tick Agent BT
                 self.BTs[i].tick()
-                # Print tree status in html file for only agent 0
-                if sl.printTree and i == 0:
-                    # print(py_trees.display.ascii_tree(self.BTs[i].root, show_status=True))
-                    f = open('BT.html', 'w')
-                    f.write('<html><head><title>Behavior Tree</title><body>')
-                    f.write(py_trees.display.xhtml_tree(self.BTs[i].root, show_status=True))
-                    f.write("</body></html>")
-                    f.close()
                 # Roll for agent death. Agent must be in motion.
-                if self.agents[i].state != "Uncommitted" and \
-                        sl.lifespan > 0 and random.random() < 1 - np.exp(-sl.dt / sl.lifespan):
-                    self.agents[i].state = "Dead"
+                if self.agents[i].state == State.Uncommitted or sl.lifespan <= 0:
+                    continue
+                if sl.presampledTransitions:
+                    dies = self.swarmState.spendClock(self.swarmState.deathClocks, i, sl.dt / sl.lifespan)
+                else:
+                    dies = random.random() < 1 - np.exp(-sl.dt / sl.lifespan)
+                if dies:
+                    self.agents[i].state = State.Dead
                     self.agents[i].committedTarget = None
                     self.agents[i].atTarget = False
 
-        self.simulation_done = all(agent.state == "Done" or agent.state == "Dead" for agent in self.agents)
+        if self.recorder is not None:
+            self.recorder.record(step)
+
+        counts = self.swarmState.stateCounts
+        self.simulation_done = bool(counts[State.Done] + counts[State.Dead] == sl.numAgents)
+        if self.termination is not None and not self.simulation_done:
+            self.stopReason = self.termination.check(self.swarmState, self.targets)
+            self.simulation_done = self.stopReason is not None
+
+        if self.shadow is not None:
+            mainRNG = random.getstate()
+            random.setstate(self.shadowRNG)
+            self.shadow.stepSimulation(self.shadow.simlaw, step)
+            self.shadowRNG = random.getstate()
+            random.setstate(mainRNG)
+            self.crossCheck(step)
+        return
+
+    def idleSteps(self, sl, limit):
+        # How many of the coming steps nothing can happen in, at most limit. That's the case while every live agent
+        # is Uncommitted and nobody has recruited it: none of them moves, sees anything new or dies, and all each tick
+        # does is spend its presampled transition clock. The steps run until the first clock would run out.
+        state = self.swarmState
+        counts = state.stateCounts
+        if self.simulation_done or counts[State.Uncommitted] + counts[State.Done] + counts[State.Dead] != sl.numAgents:
+            return 0
+        waiting = np.flatnonzero(state.states == State.Uncommitted)
+        if len(waiting) == 0:
+            return limit
+        clocks = state.transitionClocks[waiting]
+        # A clock is drawn on an agent's first roll as Uncommitted, which the next tick still has to make
+        if np.isnan(clocks).any():
+            return 0
+        for i in waiting.tolist():
+            agent = self.agents[i]
+            if agent.recruitedTo is not None and agent.recruitedTo is not agent.avoidedTarget:
+                return 0
+        hazard = sl.dt / sl.t_U_E
+        steps = int(np.ceil(clocks / hazard).min()) - 1
+        # The first clock to run out has to do so on a tick, never on a skipped step
+        while steps > 0 and (clocks - steps * hazard).min() <= 0:
+            steps -= 1
+        if self.stopReason is None and self.termination is not None and self.termination.idleSteps() is not None:
+            steps = min(steps, self.termination.idleSteps())
+        return max(0, min(steps, limit))
+
+    def skipIdle(self, sl, steps):
+        # Passes over steps that idleSteps found idle, leaving the swarm as if each one had been ticked
+        state = self.swarmState
+        waiting = np.flatnonzero(state.states == State.Uncommitted)
+        state.transitionClocks[waiting] -= steps * (sl.dt / sl.t_U_E)
+        state.timeInStates[waiting] += steps * sl.dt
+        if self.termination is not None:
+            self.termination.skip(steps)
+        if self.shadow is not None:
+            self.shadow.skipIdle(self.shadow.simlaw, steps)
+
+    def crossCheck(self, step):
+        # Raises at the first step where the compiled shadow swarm diverges from this one.
+        shadow = self.shadow
+        for i in range(self.simlaw.numAgents):
+            agent = self.agents[i]
+            other = shadow.agents[i]
+            problems = shadow.BTs[i].mismatches(self.BTs[i].root)
+            if agent.state != other.state:
+                problems.append(f"state {agent.state.name} != {other.state.name}")
+            if not np.array_equal(agent.position, other.position) or agent.heading != other.heading:
+                problems.append("position or heading")
+            if agent.committedTarget is not other.committedTarget and \
+                    (agent.committedTarget is None or other.committedTarget is None or
+                     agent.committedTarget.ID != other.committedTarget.ID):
+                problems.append("committed target")
+            if problems:
+                raise RuntimeError(f"CrossCheck: compiled BT diverged from py_trees at step {step}, "
+                                   f"agent {i}: {', '.join(problems)}")
         return
 
     def renderAgents(self, screen):
         sl = self.simlaw
+        polygons = Render.agentPolygons(sl, self.swarmState.positions, self.swarmState.headings, sl.agentSize)
         # Drawing lines and shapes specific to Agents
         for i in range(sl.numAgents):
             currentAgent = self.agents[i]
             # Setting Color
-            State = currentAgent.state
-            color = (0,0,0)
-            if State == "Uncommitted":
-                color = sl.UColor
-            elif State == "Exploring":
-                color = sl.EColor
-            elif State == "Assessing":
-                color = sl.AColor
-            elif State == "Recruiting":
-                color = sl.RColor
-            elif State == "Surveying":
-                color = sl.SColor
-            elif State == "Done":
-                color = sl.DColor
-            elif State == "Dead":
-                color = sl.XColor
+            agentState = currentAgent.state
+            color = self.stateColors[agentState]
             currentAgent.color = color
 
             # Agent Text
             if sl.renderFlavor:
                 numSeconds = 0
-                if State == "Uncommitted":
+                if agentState == State.Uncommitted:
                     numSeconds = sl.t_U_E
-                elif State == "Recruiting":
+                elif agentState == State.Recruiting:
                     numSeconds = sl.t_R_Q_a + sl.t_R_Q_b * currentAgent.qualityOfCommitted
-                elif State == "Surveying":
+                elif agentState == State.Surveying:
                     numSeconds = sl.t_Q_UR_a + sl.t_Q_UR_a * len(currentAgent.agentsAtTarget)
-                font = pygame.font.SysFont('Arial', 16)
-
                 str_ID = str(currentAgent.ID).zfill(2)
                 # str_per = str(int(currentAgent.qualityOfCommitted*100)).zfill(2)
-                if State == "Done":
+                if agentState == State.Done:
                     string_Combined = f"{str_ID}"
                 else:
-                    string_Combined = f"{str_ID}[{currentAgent.state[0]}]"
-                text_Combined = font.render(string_Combined, True, color)
+                    string_Combined = f"{str_ID}[{agentState.name[0]}]"
+                text_Combined = Render.text(string_Combined, color)
                 screen.blit(text_Combined, (sl.ppm * currentAgent.position[0], sl.ppm * currentAgent.position[1]))
                 string_Time = "{:.{}f}".format(currentAgent.timeInState, 1)
-                text_Time = font.render(string_Time, True, color)
+                text_Time = Render.text(string_Time, color)
                 screen.blit(text_Time, (sl.ppm * currentAgent.position[0], sl.ppm * currentAgent.position[1] + 10))
 
             # Vision Range
-            if currentAgent.state != "Done" and sl.renderFlavor:
+            if currentAgent.state != State.Done and sl.renderFlavor:
                 startAngle = currentAgent.heading - sl.FOV / 2
                 endAngle = currentAgent.heading + sl.FOV / 2
                 rect = [
@@ -142,8 +240,11 @@ class Swarm:
                 )
 
             # Connections to Neighbors
-            if not currentAgent.neighbors is None and currentAgent.state != "Done" and sl.renderFlavor:
-                localAgents = currentAgent.neighbors
+            if not currentAgent.neighbors is None and currentAgent.state != State.Done and sl.renderFlavor:
+                if self.perception.mode == "Batched":
+                    localAgents = [self.agents[j] for j in self.visibility.sees(i)]
+                else:
+                    localAgents = currentAgent.neighbors
                 numLocalAgents = len(localAgents)
                 for j in range(numLocalAgents):
                     pygame.draw.lines(
@@ -158,7 +259,7 @@ class Swarm:
                     )
 
             # Committed Target
-            if not currentAgent.committedTarget is None and currentAgent.state != "Done":
+            if not currentAgent.committedTarget is None and currentAgent.state != State.Done:
                 committedTarget = currentAgent.committedTarget
                 if currentAgent.atTarget:
                     thc = 3
@@ -177,7 +278,7 @@ class Swarm:
                 )
 
             # Connections to Hazards
-            if not currentAgent.knownHazards is None and currentAgent.state != "Done" and sl.renderFlavor:
+            if not currentAgent.knownHazards is None and currentAgent.state != State.Done and sl.renderFlavor:
                 localHazards = currentAgent.knownHazards
                 numLocalHazards = len(localHazards)
                 for j in range(numLocalHazards):
@@ -192,11 +293,9 @@ class Swarm:
                         1
                     )
 
-            self.agents[i].render(sl, screen)
-
-    def renderAll(self, sl, screen, clock, step, video_writer):
-        # Always check for keypress first
+            pygame.draw.lines(screen, currentAgent.color, False, polygons[i], 3)
 
+    def handleEvents(self, video_writer):
         for event in pygame.event.get():
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
@@ -208,26 +307,94 @@ class Swarm:
                 video_writer.release()
                 pygame.quit()
 
+    def drawFrame(self, sl, screen, step):
         screen.fill((0, 0, 0))
         self.environment.renderEnvironment(sl, screen, step)
         # self.targets.renderTargets(sl, screen)
         self.renderAgents(screen)
 
-        pygame.display.flip()
-        clock.tick(60)
+
+class SwarmState:
+    # Structure-of-arrays storage for the per-agent values that batched code needs. Row i belongs to agent i.
+    # States are stored as State codes. stateCounts is kept up to date on every transition, so questions like
+    # "is everyone Done or Dead?" don't need a scan of the swarm.
+    ROWS = ('positions', 'velocities', 'headings', 'speeds', 'states', 'committedTargets', 'qualities', 'timeInStates',
+            'atTargets', 'transitionClocks', 'deathClocks')
+
+    def __init__(self, sl, numAgents, targets):
+        self.numAgents = numAgents
+        self.targets = targets
+        self.dtype = np.float32 if sl.stateFloat32 else np.float64
+        self.positions = np.zeros((numAgents, 3), dtype=self.dtype)
+        self.velocities = np.zeros((numAgents, 3), dtype=self.dtype)
+        self.headings = np.zeros(numAgents, dtype=self.dtype)
+        self.speeds = np.full(numAgents, sl.maxSpeed, dtype=self.dtype)
+        self.states = np.full(numAgents, State.Uncommitted, dtype=np.int8)
+        self.stateCounts = np.zeros(len(State), dtype=np.int64)
+        self.stateCounts[State.Uncommitted] = numAgents
+        # Index into targets, or -1 if not committed
+        self.committedTargets = -np.ones(numAgents, dtype=np.int32)
+        self.qualities = np.zeros(numAgents, dtype=self.dtype)
+        self.timeInStates = np.zeros(numAgents, dtype=self.dtype)
+        self.atTargets = np.zeros(numAgents, dtype=bool)
+        # Clocks for presampledTransitions, NaN until first used. The transition clock is cleared on every state
+        # change, the death clock runs for the agent's whole life.
+        self.transitionClocks = np.full(numAgents, np.nan)
+        self.deathClocks = np.full(numAgents, np.nan)
+
+    def rows(self, start, stop, targets):
+        # A SwarmState for rows start:stop whose arrays are views into this one's. It keeps its own stateCounts and
+        # its committedTargets index into targets.
+        view = copy.copy(self)
+        for name in self.ROWS:
+            setattr(view, name, getattr(self, name)[start:stop])
+        view.numAgents = stop - start
+        view.targets = targets
+        view.stateCounts = np.bincount(view.states, minlength=len(State)).astype(np.int64)
+        return view
+
+    def setStates(self, indices, value):
+        # Batched version of the Agent.state setter. indices must not repeat.
+        self.stateCounts -= np.bincount(self.states[indices], minlength=len(self.stateCounts))
+        self.stateCounts[value] += len(indices)
+        self.transitionClocks[indices[self.states[indices] != value]] = np.nan
+        self.states[indices] = value
+
+    def spendClock(self, clocks, index, hazard):
+        # Replaces a roll that passes with probability 1 - exp(-hazard), where hazard = dt / numSeconds.
+        # A clock starts at an Exp(1) draw and loses hazard on every roll, running out on the roll that would have
+        # passed. The chance of surviving k rolls is exp(-sum of hazards) either way, so the distribution is the same
+        # even when numSeconds changes between rolls, and the clock never needs resampling.
+        clock = clocks[index]
+        if clock != clock:
+            clock = -math.log(1.0 - random.random())
+        clock -= hazard
+        clocks[index] = np.nan if clock <= 0 else clock
+        return clock <= 0
+
+    def spendClocks(self, clocks, indices, hazards, exponential):
+        # Batched version of spendClock. exponential(fresh) draws new clocks for the agents in fresh.
+        # Returns a mask of clocks that ran out.
+        fresh = indices[np.isnan(clocks[indices])]
+        clocks[fresh] = exponential(fresh)
+        clocks[indices] -= hazards
+        expired = clocks[indices] <= 0
+        clocks[indices[expired]] = np.nan
+        return expired
 
 
 class Agent():
-    def __init__(self, sl):
+    # A view over one row of a SwarmState. Values stored there are exposed as properties below.
+    def __init__(self, sl, swarmState=None, index=0):
         super().__init__()
         self.sl = sl
-        self.position = np.array([0.0, 0.0, 0.0])
-        self.heading = 0.0
-        self.velocity = np.array([0.0, 0.0, 0.0])
+        if swarmState is None:
+            swarmState = SwarmState(sl, 1, [])
+        self.swarmState = swarmState
+        self.index = index
         self.speed = sl.maxSpeed
 
-        # State can be Uncommitted, Assessing, Recruiting, Surveying, or Done.
-        self.state = "Uncommitted"
+        self.state = State.Uncommitted
         self.timeInState = 0
 
         self.waypoints = []
@@ -252,43 +419,87 @@ class Agent():
         self.threateningNeighbor = None
         self.boundError = None
 
+    @property
+    def position(self):
+        return self.swarmState.positions[self.index]
+
+    @position.setter
+    def position(self, value):
+        self.swarmState.positions[self.index] = value
+
+    @property
+    def velocity(self):
+        return self.swarmState.velocities[self.index]
+
+    @velocity.setter
+    def velocity(self, value):
+        self.swarmState.velocities[self.index] = value
+
+    @property
+    def heading(self):
+        return float(self.swarmState.headings[self.index])
+
+    @heading.setter
+    def heading(self, value):
+        self.swarmState.headings[self.index] = value
+
+    @property
+    def speed(self):
+        return float(self.swarmState.speeds[self.index])
+
+    @speed.setter
+    def speed(self, value):
+        self.swarmState.speeds[self.index] = value
+
+    @property
+    def state(self):
+        return STATES[self.swarmState.states[self.index]]
+
+    @state.setter
+    def state(self, value):
+        swarmState = self.swarmState
+        if swarmState.states[self.index] != value:
+            swarmState.transitionClocks[self.index] = np.nan
+        swarmState.stateCounts[swarmState.states[self.index]] -= 1
+        swarmState.stateCounts[value] += 1
+        swarmState.states[self.index] = value
+
+    @property
+    def committedTarget(self):
+        targetIndex = self.swarmState.committedTargets[self.index]
+        if targetIndex < 0:
+            return None
+        return self.swarmState.targets[targetIndex]
+
+    @committedTarget.setter
+    def committedTarget(self, value):
+        self.swarmState.committedTargets[self.index] = -1 if value is None else value.ID
+
+    @property
+    def qualityOfCommitted(self):
+        return float(self.swarmState.qualities[self.index])
+
+    @qualityOfCommitted.setter
+    def qualityOfCommitted(self, value):
+        self.swarmState.qualities[self.index] = value
+
+    @property
+    def timeInState(self):
+        return float(self.swarmState.timeInStates[self.index])
+
+    @timeInState.setter
+    def timeInState(self, value):
+        self.swarmState.timeInStates[self.index] = value
+
+    @property
+    def atTarget(self):
+        return bool(self.swarmState.atTargets[self.index])
+
+    @atTarget.setter
+    def atTarget(self, value):
+        self.swarmState.atTargets[self.index] = value
 
     def render(self, sl, screen):
-        sz = self.radius
-        pos = self.position
-        head = self.heading
-        if sl.agentAppearance == "cross":
-            c = np.multiply(sz, [[1, 1], [-1, -1], [0, 0], [1, -1], [-1, 1]])
-            c = \
-                [
-                    [c[0][0] * np.cos(head) - c[0][1] * np.sin(head), -c[0][0] * np.sin(head) - c[0][1] * np.cos(head)],
-                    [c[1][0] * np.cos(head) - c[1][1] * np.sin(head), -c[1][0] * np.sin(head) - c[1][1] * np.cos(head)],
-                    [c[2][0] * np.cos(head) - c[2][1] * np.sin(head), -c[2][0] * np.sin(head) - c[2][1] * np.cos(head)],
-                    [c[3][0] * np.cos(head) - c[3][1] * np.sin(head), -c[3][0] * np.sin(head) - c[3][1] * np.cos(head)],
-                    [c[4][0] * np.cos(head) - c[4][1] * np.sin(head), -c[4][0] * np.sin(head) - c[4][1] * np.cos(head)]
-                ]
-            cross = \
-                [
-                    (sl.ppm * (pos[0] + c[0][0]), sl.ppm * (pos[1] + c[0][1])),
-                    (sl.ppm * (pos[0] + c[1][0]), sl.ppm * (pos[1] + c[1][1])),
-                    (sl.ppm * (pos[0] + c[2][0]), sl.ppm * (pos[1] + c[2][1])),
-                    (sl.ppm * (pos[0] + c[3][0]), sl.ppm * (pos[1] + c[3][1])),
-                    (sl.ppm * (pos[0] + c[4][0]), sl.ppm * (pos[1] + c[4][1]))
-                ]
-            pygame.draw.lines(screen, self.color, False, cross, 3)
-        elif sl.agentAppearance == "triangle":
-            t = np.multiply(sz, [[1, 0], [-1, -0.8], [-1, 0.8]])
-            t = \
-                [
-                    [t[0][0] * np.cos(head) - t[0][1] * np.sin(head), -t[0][0] * np.sin(head) - t[0][1] * np.cos(head)],
-                    [t[1][0] * np.cos(head) - t[1][1] * np.sin(head), -t[1][0] * np.sin(head) - t[1][1] * np.cos(head)],
-                    [t[2][0] * np.cos(head) - t[2][1] * np.sin(head), -t[2][0] * np.sin(head) - t[2][1] * np.cos(head)]
-                ]
-            triangle = \
-                [
-                    (sl.ppm * (pos[0] + t[0][0]), sl.ppm * (pos[1] + t[0][1])),
-                    (sl.ppm * (pos[0] + t[1][0]), sl.ppm * (pos[1] + t[1][1])),
-                    (sl.ppm * (pos[0] + t[2][0]), sl.ppm * (pos[1] + t[2][1])),
-                    (sl.ppm * (pos[0] + t[0][0]), sl.ppm * (pos[1] + t[0][1]))
-                ]
-            pygame.draw.lines(screen, self.color, False, triangle, 3)
+        # Single-agent drawing. Swarm.renderAgents draws all agents' outlines from one batched transform instead.
+        polygon = Render.agentPolygons(sl, self.position[None], np.array([self.heading]), self.radius)[0]
+        pygame.draw.lines(screen, self.color, False, polygon, 3)
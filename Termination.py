@@ -0,0 +1,55 @@
+import numpy as np
+from States import State
+
+# Why a run ended, as recorded in its output row. "Done" is the normal end (every agent Done or Dead) and "TimeLimit"
+# the end of a Mode 2 run that wasn't done. The others are the opt-in criteria below.
+REASONS = ("Done", "TimeLimit", "Quorum", "RankingStable", "OnlyUncommitted")
+
+
+def enabled(sl):
+    return sl.stopAtQuorum > 0 or sl.stopWhenRankingStable > 0 or sl.stopWhenOnlyUncommitted
+
+
+class Termination:
+    # Opt-in criteria that end a run before every agent is Done or Dead:
+    #   Quorum:          some target has at least stopAtQuorum of the swarm
+    #   RankingStable:   the order of targets by numAgents hasn't changed for stopWhenRankingStable steps, counted
+    #                    from the first agent to finish at a target
+    #   OnlyUncommitted: some agents are finished and all others are Uncommitted
+    # Keeps its own counters, so a swarm owns one and snapshots carry it along.
+    def __init__(self, sl):
+        self.sl = sl
+        self.ranking = None
+        self.stableSteps = 0
+
+    def check(self, swarmState, targets):
+        # Name of the criterion that ends the run after this step, or None
+        sl = self.sl
+        counts = np.array([target.numAgents for target in targets])
+        numAgents = swarmState.numAgents
+        if sl.stopAtQuorum > 0 and len(counts) > 0 and counts.max() >= sl.stopAtQuorum * numAgents:
+            return "Quorum"
+        if sl.stopWhenRankingStable > 0 and counts.sum() > 0:
+            ranking = tuple(np.argsort(-counts, kind='stable'))
+            self.stableSteps = self.stableSteps + 1 if ranking == self.ranking else 0
+            self.ranking = ranking
+            if self.stableSteps >= sl.stopWhenRankingStable:
+                return "RankingStable"
+        if sl.stopWhenOnlyUncommitted:
+            stateCounts = swarmState.stateCounts
+            finished = stateCounts[State.Done] + stateCounts[State.Dead]
+            if finished > 0 and finished + stateCounts[State.Uncommitted] == numAgents:
+                return "OnlyUncommitted"
+        return None
+
+    def idleSteps(self):
+        # How many steps without any change in the swarm can pass before a criterion fires, or None if none would.
+        # Only the ranking count moves while nothing changes.
+        if self.sl.stopWhenRankingStable > 0 and self.ranking is not None:
+            return max(0, self.sl.stopWhenRankingStable - self.stableSteps - 1)
+        return None
+
+    def skip(self, steps):
+        # Counts steps passed over by Swarm.skipIdle as checked
+        if self.ranking is not None:
+            self.stableSteps += steps
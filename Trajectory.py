@@ -0,0 +1,151 @@
+import copy
+import multiprocessing
+import os
+import pickle
+import shutil
+import subprocess
+import warnings
+import cv2
+import numpy as np
+import Render
+from Environment import Environment
+from Swarm import Swarm, SwarmState, Agent
+
+# Per-agent values logged every frame, with the dtype they are stored as
+FIELDS = (('positions', np.float32), ('headings', np.float32), ('states', np.int8), ('committedTargets', np.int8),
+          ('atTargets', bool), ('timeInStates', np.float32))
+
+
+class TrajectoryRecorder:
+    # Logs what the renderer needs of every frame of a run (the same steps that would be rendered: step 1 and every
+    # frameSkip-th step), so that render_video can make the video afterwards. Recording touches no pygame at all.
+    # Perception isn't logged, so lines to seen neighbors and hazards are left out of the video.
+    def __init__(self, swarm):
+        self.swarm = swarm
+        self.frameSkip = max(1, swarm.simlaw.frameSkip)
+        self.steps = []
+        self.frames = {name: [] for name, _ in FIELDS}
+
+    def record(self, step):
+        if step % self.frameSkip != 0 and step != 1:
+            return
+        swarmState = self.swarm.swarmState
+        self.steps.append(step)
+        for name, dtype in FIELDS:
+            values = getattr(swarmState, name)
+            if name == 'positions':
+                values = values[:, :2]
+            self.frames[name].append(values.astype(dtype))
+
+    def save(self, filename):
+        sl = copy.copy(self.swarm.simlaw)
+        sl.SLs = None
+        np.savez_compressed(filename, steps=np.array(self.steps, dtype=np.int64),
+                            simlaw=np.frombuffer(pickle.dumps(sl), dtype=np.uint8),
+                            **{name: np.array(self.frames[name], dtype=dtype) for name, dtype in FIELDS})
+
+
+class Replay:
+    # Just enough of a Swarm for Swarm.renderAgents to draw logged frames
+    def __init__(self, sl):
+        self.simlaw = sl
+        self.environment = Environment(sl)
+        self.swarmState = SwarmState(sl, sl.numAgents, self.environment.targets)
+        self.agents = [Agent(sl, self.swarmState, i) for i in range(sl.numAgents)]
+        for i in range(sl.numAgents):
+            self.agents[i].ID = i
+            self.agents[i].neighbors = None
+            self.agents[i].knownHazards = None
+        self.stateColors = (sl.UColor, sl.EColor, sl.AColor, sl.RColor, sl.SColor, sl.DColor, sl.XColor)
+
+    def show(self, log, frame):
+        swarmState = self.swarmState
+        swarmState.positions[:, :2] = log['positions'][frame]
+        swarmState.headings[:] = log['headings'][frame]
+        swarmState.states[:] = log['states'][frame]
+        swarmState.committedTargets[:] = log['committedTargets'][frame]
+        swarmState.atTargets[:] = log['atTargets'][frame]
+        swarmState.timeInStates[:] = log['timeInStates'][frame]
+
+    def draw(self, screen, step):
+        screen.fill((0, 0, 0))
+        self.environment.renderEnvironment(self.simlaw, screen, step)
+        Swarm.renderAgents(self, screen)
+
+
+def load(filename):
+    # (SimLaw, log) of a saved trajectory, where log maps 'steps' and each logged value to an array over frames
+    log = dict(np.load(filename))
+    sl = pickle.loads(log.pop('simlaw').tobytes())
+    sl.staticField = False
+    return sl, log
+
+
+def render_part(task):
+    # Pool entry point. Renders frames start:stop of a trajectory into their own video file.
+    filename, videoFilename, start, stop, fps = task
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    # Workers forked after a run inherit the 'error' filter AgentControllerBT sets, which would turn harmless pygame
+    # font warnings into failures
+    warnings.simplefilter('default')
+    import pygame
+    pygame.init()
+    sl, log = load(filename)
+    replay = Replay(sl)
+    size = (replay.environment.width, replay.environment.height)
+    screen = pygame.Surface(size)
+    videoWriter = cv2.VideoWriter(videoFilename, cv2.VideoWriter_fourcc(*'mp4v'), fps, size, isColor=True)
+    for frame in range(start, stop):
+        replay.show(log, frame)
+        replay.draw(screen, int(log['steps'][frame]))
+        image = pygame.surfarray.array3d(screen)
+        videoWriter.write(cv2.cvtColor(image.swapaxes(0, 1), cv2.COLOR_RGB2BGR))
+    videoWriter.release()
+    pygame.quit()
+    Render.clear()
+    return videoFilename
+
+
+def concatenate(parts, videoFilename, fps):
+    # Joins part videos in order. ffmpeg copies the streams if it's installed, otherwise the frames are re-encoded.
+    if shutil.which('ffmpeg'):
+        listFilename = videoFilename + '.txt'
+        with open(listFilename, 'w') as f:
+            for part in parts:
+                f.write(f"file '{os.path.abspath(part)}'\n")
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listFilename,
+                        '-c', 'copy', videoFilename], check=True)
+        os.remove(listFilename)
+        return
+    videoWriter = None
+    for part in parts:
+        capture = cv2.VideoCapture(part)
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            if videoWriter is None:
+                size = (image.shape[1], image.shape[0])
+                videoWriter = cv2.VideoWriter(videoFilename, cv2.VideoWriter_fourcc(*'mp4v'), fps, size,
+                                              isColor=True)
+            videoWriter.write(image)
+        capture.release()
+    if videoWriter is not None:
+        videoWriter.release()
+
+
+def render_video(filename, videoFilename=None, processes=None, fps=30):
+    # Renders a saved trajectory to an mp4, splitting its frames into one contiguous range per process
+    if videoFilename is None:
+        videoFilename = os.path.splitext(filename)[0] + '.mp4'
+    processes = processes or os.cpu_count()
+    with np.load(filename) as log:
+        numFrames = len(log['steps'])
+    bounds = np.linspace(0, numFrames, min(processes, max(1, numFrames)) + 1).astype(int)
+    tasks = [(filename, f"{videoFilename}.part{k}.mp4", bounds[k], bounds[k + 1], fps) for k in range(len(bounds) - 1)]
+    with multiprocessing.Pool(len(tasks)) as pool:
+        parts = pool.map(render_part, tasks)
+    concatenate(parts, videoFilename, fps)
+    for part in parts:
+        os.remove(part)
+    return videoFilename
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+import cv2
+import pygame
+
+
+class VideoEncoder:
+    # Writes video frames on a background thread. Frames are drawn straight onto surfaces from a small pool and handed
+    # over whole, so the simulation never copies or converts pixels. The thread converts and encodes each one (OpenCV
+    # lets go of the GIL meanwhile), then gives the surface back to the pool.
+    # If every surface is still waiting to be encoded when a frame is due, the frame is dropped and frameSkip doubles,
+    # so recording never holds up the simulation. Once the thread catches up, frameSkip halves back towards the
+    # configured value.
+    def __init__(self, filename, fps, size, frameSkip=1, numBuffers=4):
+        self.videoWriter = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), fps, size, isColor=True)
+        self.baseFrameSkip = max(1, frameSkip)
+        self.frameSkip = self.baseFrameSkip
+        self.numBuffers = numBuffers
+        self.free = queue.Queue()
+        for _ in range(numBuffers):
+            self.free.put(pygame.Surface(size))
+        self.frames = queue.Queue()
+        self.thread = threading.Thread(target=self.encode, daemon=True)
+        self.thread.start()
+        self.released = False
+
+    def wants(self, step):
+        return step % self.frameSkip == 0 or step == 1
+
+    def surface(self):
+        # A surface to draw the next frame on, or None if the frame has to be dropped
+        try:
+            surface = self.free.get_nowait()
+        except queue.Empty:
+            self.frameSkip *= 2
+            return None
+        if self.free.qsize() == self.numBuffers - 1 and self.frameSkip > self.baseFrameSkip:
+            self.frameSkip //= 2
+        return surface
+
+    def write(self, surface):
+        self.frames.put(surface)
+
+    def encode(self):
+        while True:
+            surface = self.frames.get()
+            if surface is None:
+                return
+            pixels = pygame.surfarray.pixels3d(surface)
+            image = cv2.cvtColor(pixels.swapaxes(0, 1), cv2.COLOR_RGB2BGR)
+            del pixels
+            self.videoWriter.write(image)
+            self.free.put(surface)
+
+    def release(self):
+        # Finishes the queued frames and closes the file. Safe to call more than once.
+        if self.released:
+            return
+        self.released = True
+        self.frames.put(None)
+        self.thread.join()
+        self.videoWriter.release()
+
+
+class Viewer:
+    # Shows a rendered run on screen at displayRate and records it through a VideoEncoder, without tying stepping
+    # to either. A frame is only drawn when the screen is due for a refresh or the encoder wants one.
+    def __init__(self, sl, swarm, screen, videoWriter):
+        self.sl = sl
+        self.swarm = swarm
+        self.screen = screen
+        self.videoWriter = videoWriter
+        self.interval = 1 / sl.displayRate if sl.displayRate > 0 else 0
+        self.lastFlip = 0
+
+    def update(self, step):
+        swarm = self.swarm
+        swarm.handleEvents(self.videoWriter)
+        surface = self.videoWriter.surface() if self.videoWriter.wants(step) else None
+        now = time.time()
+        show = now - self.lastFlip >= self.interval
+        if surface is None and not show:
+            return
+        swarm.drawFrame(self.sl, surface if surface is not None else self.screen, step)
+        if show:
+            if surface is not None:
+                self.screen.blit(surface, (0, 0))
+            pygame.display.flip()
+            self.lastFlip = now
+        if surface is not None:
+            self.videoWriter.write(surface)
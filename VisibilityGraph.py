@@ -0,0 +1,35 @@
+import numpy as np
+
+
+class VisibilityGraph:
+    # Which agents see which, stored as compressed sparse rows in both directions:
+    #   sees:   row i lists the agents that agent i sees
+    #   seenBy: row i lists the agents that see agent i
+    # Rows are in ascending agent order. Perception rebuilds the graph once per step.
+    def __init__(self, numAgents):
+        self.numAgents = numAgents
+        self.build(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def build(self, i, j):
+        # i and j are arrays of edges "i sees j", sorted by i then j
+        rows = np.arange(self.numAgents + 1)
+        self.seesIndices = j
+        self.seesIndptr = np.searchsorted(i, rows)
+        order = np.lexsort((i, j))
+        self.seenByIndices = i[order]
+        self.seenByIndptr = np.searchsorted(j[order], rows)
+
+    def sees(self, agentNum):
+        return self.seesIndices[self.seesIndptr[agentNum]:self.seesIndptr[agentNum + 1]]
+
+    def seenBy(self, agentNum):
+        return self.seenByIndices[self.seenByIndptr[agentNum]:self.seenByIndptr[agentNum + 1]]
+
+    def edgesFrom(self, agentNums):
+        # Forward edges of several agents at once, as (k, j): the k-th agent in agentNums sees agent j
+        starts = self.seesIndptr[agentNums]
+        counts = self.seesIndptr[agentNums + 1] - starts
+        total = counts.sum()
+        k = np.repeat(np.arange(len(agentNums)), counts)
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return k, self.seesIndices[offsets]
@@ -1,9 +1,11 @@
 import os
-import csv
 import multiprocessing
 import Config_Max as config
 import MultiLaw
 import Simulator
+import Lockstep
+import Scheduler
+import ResultStore
 import time
 import numpy as np
 
@@ -19,11 +21,13 @@ if __name__ == '__main__':
     h = str(time.gmtime().tm_hour).zfill(2)
     m = str(time.gmtime().tm_min).zfill(2)
     s = str(time.gmtime().tm_sec).zfill(2)
-    filename = "Megarun_"+y+M+d+'_'+h+m+s+".csv"
+    filename = "Megarun_"+y+M+d+'_'+h+m+s
     # root_folder = "Output_Media"
     # if not os.path.isdir(root_folder):
     #     os.mkdir(root_folder)
-    outputArray = []
+    # Results go to a columnar store in the folder filename, a csv file, or both
+    folder = filename if sl.resultFormat in ("Columnar", "Both") else None
+    csvFilename = filename + ".csv" if sl.resultFormat in ("CSV", "Both") else None
 
     if sl.multiLaw:
         # Setup an array of simlaws unique to each simulation.
@@ -70,21 +74,31 @@ if __name__ == '__main__':
         # Save the array of simlaws to the original simlaw.
         sl.SLs = simLaws
         print(f"All done setting up for {combinations} simulations.")
-        with multiprocessing.Pool() as pool:
-            for result in pool.imap(Simulator.run_simulations, simLaws):
-                outputArray.append(result)
-                with open(filename, 'a', newline='') as csvfile:
-                    writer = csv.writer(csvfile, delimiter=',')
-                    writer.writerow(result)
-                    csvfile.close()
+        processes = os.cpu_count()
+        # Jobs are positions in simLaws, each run by one call in a worker
+        if sl.lockstep:
+            # Runs that differ only in rngSeed are advanced together
+            seedIndex = varNames.index("rngSeed") if "rngSeed" in varNames else None
+            groups = {}
+            for position, simLaw in enumerate(simLaws):
+                key = tuple(value for i, value in enumerate(simLaw.varValue) if i != seedIndex)
+                groups.setdefault(key, []).append(position)
+            scheduler = Scheduler.Scheduler(simLaws, list(groups.values()), Lockstep.run_lockstep, processes)
+        else:
+            scheduler = Scheduler.Scheduler(simLaws, [[position] for position in range(len(simLaws))],
+                                            Scheduler.run_each, processes)
+        writer = ResultStore.ResultWriter(folder, varNames, varValues, max(simLaw.numTargets for simLaw in simLaws),
+                                          csvFilename)
+        with multiprocessing.Pool(processes) as pool:
+            # Runs finish out of order, but rows come back in simLaws order
+            for result in scheduler.run(pool):
+                writer.write(result)
+        writer.close()
     else:
         # Assume that not using parallel processing == not using multilaw == Running one sim
-        result = Simulator.run_simulations(sl)
-        outputArray.append(result)
-        with open(filename, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow(result)
-            csvfile.close()
+        writer = ResultStore.ResultWriter(folder, [], [], sl.numTargets, csvFilename)
+        writer.write(Simulator.run_simulations(sl))
+        writer.close()
     endTime = time.time()
     print(f"Done with all sims, time taken is {endTime - startTime:7.0f}s")
 